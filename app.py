@@ -1,49 +1,63 @@
-import threading
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, session, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from jinja2 import FileSystemBytecodeCache
 from flask_mail import Mail, Message
 from werkzeug.utils import secure_filename
 import os
-import qrcode
-from io import BytesIO
-import base64
 import logging
 from config import config
 from config_local import *
-from models import db, Package
-from utils import send_shenzhen_arrival_email, send_cafe_arrival_email, generate_pickup_codes_qr, validate_email_address
+from models import db, Package, EmailJob, ensure_columns, ensure_indexes, to_paris, STATUS_DISPLAY
+from utils import generate_pickup_codes_qr, validate_email_address
+from importer import import_excel_file
+from pickup_codes import release_pickup_codes
+from mail_queue import MailQueue, enqueue_emails, notify_workers
+from email_render import EmailRenderer
+from pagination import keyset_paginate, CountCache
+from presenter import present, present_page
+from search import apply_search, ensure_search_index
+import package_feed
+from stats_engine import StatsEngine, ensure_daily_stats
+from qr_cache import QRCache
+from package_qr import get_package_qr, delete_package_qrs
+from pickup_feed import (pickup_codes_version, version_etag, pickup_codes_rows, active_set_filter,
+                         overdue_filter, overdue_rows)
+from change_feed import ChangeFeed
+from bulk_ops import bulk_delete_packages, bulk_transition, parse_identifiers, publish_bulk_changes, TRANSITIONS
+from collections import Counter
+from pickup_desk import ActiveCodeCache, active_item, confirm_pickup, inactive_code_reason
+from db_engine import engine_options, PoolMonitor
+from metrics import Metrics
 from functools import wraps
 
-def send_email_async(package, email_type, mail, app):
-    """异步发送邮件"""
-    with app.app_context():
-        try:
-            if email_type == 'shenzhen':
-                success = send_shenzhen_arrival_email(package, mail)
-            elif email_type == 'cafe':
-                success = send_cafe_arrival_email(package, mail)
-            else:
-                return False
-            
-            if success:
-                logging.info(f'异步邮件发送成功: {package.customer_email} ({email_type})')
-            else:
-                logging.error(f'异步邮件发送失败: {package.customer_email} ({email_type})')
-            
-            return success
-        except Exception as e:
-            logging.error(f'异步邮件发送异常: {str(e)}')
-            return False
-
 def create_app(config_name='default'):
     """应用工厂函数"""
     app = Flask(__name__)
     app.config.from_object(config[config_name])
     
+    # Jinja 字节码缓存：新进程加载模板时读取已编译的字节码，不再从源码编译（源码变化时自动失效）
+    if app.config.get('JINJA_BYTECODE_CACHE', True):
+        cache_dir = app.config.get('JINJA_CACHE_DIR') or os.path.join(app.instance_path, 'jinja_cache')
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+        except OSError as e:
+            app.logger.warning(f"模板字节码缓存目录不可用: {e}")
+    
     # 初始化扩展
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
     db.init_app(app)
+    pool_monitor = PoolMonitor(app)
+    metrics = Metrics(app)
     mail = Mail(app)
+    EmailRenderer(app)
+    mail_queue = MailQueue(app, mail)
+    count_cache = CountCache(ttl=app.config.get('COUNT_CACHE_TTL', 30))
+    stats_engine = StatsEngine(app)
+    qr_cache = QRCache(app)
+    change_feed = ChangeFeed(app)
+    active_codes = ActiveCodeCache(app)
     
     # 注册模板过滤器
     @app.template_filter('format_datetime')
@@ -52,13 +66,7 @@ def create_app(config_name='default'):
             return ''
         # 转换为巴黎时间
         try:
-            import pytz
-            utc_tz = pytz.UTC
-            paris_tz = pytz.timezone('Europe/Paris')
-            if dt.tzinfo is None:
-                dt = utc_tz.localize(dt)
-            paris_time = dt.astimezone(paris_tz)
-            return paris_time.strftime('%Y-%m-%d %H:%M:%S')
+            return to_paris(dt).strftime('%Y-%m-%d %H:%M:%S')
         except:
             # 如果转换失败，返回原始时间
             return dt.strftime('%Y-%m-%d %H:%M:%S')
@@ -72,6 +80,11 @@ def create_app(config_name='default'):
         }
         return status_info.get(status, {'display': '未知状态', 'icon': 'fas fa-question', 'class': 'secondary'})
     
+    @app.before_request
+    def start_mail_queue():
+        # 在处理请求的进程中启动发件worker（gunicorn fork 之后各自启动）
+        mail_queue.ensure_started()
+    
     # 错误处理
     @app.errorhandler(404)
     def not_found_error(error):
@@ -98,135 +111,30 @@ def create_app(config_name='default'):
         
         # 处理Excel导入
         if request.method == 'POST':
-            file = request.files.get('excel_file')
-            if not file:
-                import_result = {'success': False, 'error': '请选择要上传的文件'}
-            elif not file.filename:
-                import_result = {'success': False, 'error': '文件名不能为空'}
-            elif not file.filename.endswith('.xlsx'):
-                import_result = {'success': False, 'error': '请上传xlsx格式的Excel文件'}
-            else:
-                try:
-                    # 检查文件是否为空
-                    file.seek(0, 2)  # 移动到文件末尾
-                    file_size = file.tell()
-                    file.seek(0)  # 重置到文件开头
-                    
-                    if file_size == 0:
-                        import_result = {'success': False, 'error': '上传的文件为空'}
-                    elif file_size > app.config.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024):
-                        import_result = {'success': False, 'error': '文件大小超过限制（最大16MB）'}
-                    else:
-                        # 使用openpyxl读取Excel文件
-                        from openpyxl import load_workbook
-                        wb = load_workbook(file, data_only=True)
-                        ws = wb.active
-                        
-                        # 获取表头
-                        headers = []
-                        for cell in ws[1]:
-                            headers.append(str(cell.value).strip() if cell.value else '')
-                        
-                        required_cols = ['客户名称', '快递单号', '客户邮箱', '备注']
-                        missing_cols = [col for col in required_cols if col not in headers]
-                        
-                        if missing_cols:
-                            import_result = {'success': False, 'error': f'Excel缺少必要列: {", ".join(missing_cols)}，请使用模板'}
-                        else:
-                            rows = []
-                            ids = []
-                            skipped_rows = []
-                            
-                            # 获取列索引
-                            customer_name_idx = headers.index('客户名称')
-                            tracking_number_idx = headers.index('快递单号')
-                            email_idx = headers.index('客户邮箱')
-                            notes_idx = headers.index('备注')
-                            
-                            # 处理数据行
-                            for row_num in range(2, ws.max_row + 1):
-                                customer_name = str(ws.cell(row=row_num, column=customer_name_idx + 1).value or '').strip()
-                                tracking_number = str(ws.cell(row=row_num, column=tracking_number_idx + 1).value or '').strip()
-                                email = str(ws.cell(row=row_num, column=email_idx + 1).value or '').strip()
-                                notes = str(ws.cell(row=row_num, column=notes_idx + 1).value or '').strip()
-                                
-                                if not customer_name or not tracking_number or not email:
-                                    continue
-                                
-                                # 检查快递单号是否已存在
-                                existing_package = Package.query.filter_by(shenzhen_tracking_number=tracking_number).first()
-                                if existing_package:
-                                    skipped_rows.append({
-                                        'customer_name': customer_name,
-                                        'tracking_number': tracking_number,
-                                        'email': email,
-                                        'notes': notes,
-                                        'reason': '快递单号已存在'
-                                    })
-                                    continue
-                                
-                                # 创建包裹
-                                package = Package(
-                                    customer_name=customer_name,
-                                    shenzhen_tracking_number=tracking_number,
-                                    customer_email=email,
-                                    notes=notes,
-                                    pickup_code=Package.generate_pickup_code()
-                                )
-                                db.session.add(package)
-                                db.session.flush()  # 获取ID
-                                ids.append(package.id)
-                                rows.append({
-                                    'customer_name': customer_name,
-                                    'tracking_number': tracking_number,
-                                    'email': email,
-                                    'notes': notes
-                                })
-                            db.session.commit()
-                            import_result = {
-                                'success': True, 
-                                'count': len(rows), 
-                                'rows': rows, 
-                                'ids': ids,
-                                'skipped_count': len(skipped_rows),
-                                'skipped_rows': skipped_rows
-                            }
-                except Exception as e:
-                    db.session.rollback()
-                    error_msg = str(e)
-                    if "File is not a zip file" in error_msg:
-                        import_result = {'success': False, 'error': '文件格式错误：请确保上传的是有效的Excel文件(.xlsx)，不是其他格式的文件'}
-                    elif "No sheet names" in error_msg:
-                        import_result = {'success': False, 'error': 'Excel文件没有工作表，请检查文件内容'}
-                    else:
-                        import_result = {'success': False, 'error': f'导入失败: {error_msg}'}
+            import_result = import_excel_file(request.files.get('excel_file'))
         
         # 获取包裹列表
-        page = request.args.get('page', 1, type=int)
+        after = request.args.get('after', '')
+        before = request.args.get('before', '')
         status_filter = request.args.get('status', '')
         search = request.args.get('search', '')
         
         # 构建查询
         query = Package.query
         
-        if status_filter:
+        if status_filter == 'overdue':
+            # 逾期包裹由 (status, pickup_deadline) 索引直接得出
+            query = query.filter(overdue_filter())
+        elif status_filter:
             query = query.filter_by(status=status_filter)
         
         if search:
-            search_term = f'%{search}%'
-            query = query.filter(
-                db.or_(
-                    Package.customer_name.like(search_term),
-                    Package.customer_email.like(search_term),
-                    Package.shenzhen_tracking_number.like(search_term),
-                    Package.pickup_code.like(search_term)
-                )
-            )
+            query = apply_search(query, search)
         
-        # 分页
-        packages = query.order_by(Package.cafe_arrival_date.desc().nullslast()).paginate(
-            page=page, per_page=app.config['ITEMS_PER_PAGE'], error_out=False
-        )
+        # 键集分页：按 (cafe_arrival_date, id) 游标翻页，深页与首页代价相同
+        packages = keyset_paginate(query, app.config['ITEMS_PER_PAGE'], after=after, before=before)
+        packages.total = count_cache.get((status_filter, search), query.count)
+        present_page(packages)
         
         return render_template('index.html', packages=packages, 
                              status_filter=status_filter, search=search,
@@ -287,13 +195,13 @@ def create_app(config_name='default'):
                 )
                 
                 db.session.add(package)
-                db.session.commit()
+                db.session.flush()
                 
-                # 发送深圳到达通知邮件
-                if send_shenzhen_arrival_email(package, mail):
-                    flash(f'包裹记录创建成功！深圳快递单号: {shenzhen_tracking_number}，取件码: {package.pickup_code}，深圳到达通知邮件已发送给客户。', 'success')
-                else:
-                    flash(f'包裹记录创建成功！深圳快递单号: {shenzhen_tracking_number}，取件码: {package.pickup_code}，但邮件发送失败。请检查邮件配置。', 'warning')
+                # 深圳到达通知邮件加入发送队列，与包裹记录一起提交
+                enqueue_emails([package.id], 'shenzhen')
+                db.session.commit()
+                notify_workers()
+                flash(f'包裹记录创建成功！深圳快递单号: {shenzhen_tracking_number}，取件码: {package.pickup_code}，深圳到达通知邮件已加入发送队列。', 'success')
                 
                 return redirect(url_for('index'))
                 
@@ -312,17 +220,17 @@ def create_app(config_name='default'):
     def package_detail(package_id):
         """包裹详情页面"""
         package = Package.query.get_or_404(package_id)
-        return render_template('package_detail.html', package=package)
+        return render_template('package_detail.html', package=present([package])[0])
     
     @app.route('/package/<int:package_id>/resend_shenzhen_email')
     def resend_shenzhen_email(package_id):
         """重新发送深圳到达通知邮件"""
         package = Package.query.get_or_404(package_id)
         
-        if send_shenzhen_arrival_email(package, mail):
-            flash('深圳到达通知邮件已重新发送！', 'success')
-        else:
-            flash('邮件发送失败。请检查邮件配置。', 'error')
+        enqueue_emails([package.id], 'shenzhen', force=True)
+        db.session.commit()
+        notify_workers()
+        flash('深圳到达通知邮件已加入发送队列，将在后台重新发送！', 'success')
         
         return redirect(url_for('package_detail', package_id=package_id))
     
@@ -331,10 +239,10 @@ def create_app(config_name='default'):
         """重新发送咖啡馆到达通知邮件"""
         package = Package.query.get_or_404(package_id)
         
-        if send_cafe_arrival_email(package, mail):
-            flash('咖啡馆到达通知邮件已重新发送！', 'success')
-        else:
-            flash('邮件发送失败。请检查邮件配置。', 'error')
+        enqueue_emails([package.id], 'cafe', force=True)
+        db.session.commit()
+        notify_workers()
+        flash('咖啡馆到达通知邮件已加入发送队列，将在后台重新发送！', 'success')
         
         return redirect(url_for('package_detail', package_id=package_id))
     
@@ -389,13 +297,12 @@ def create_app(config_name='default'):
             package.status = 'cafe_arrived'
             package.cafe_arrival_date = datetime.utcnow()
             package.updated_at = datetime.utcnow()
-            db.session.commit()
             
-            # 发送咖啡馆到达通知邮件
-            if send_cafe_arrival_email(package, mail):
-                flash(f'包裹已标记为到达咖啡馆！取件码: {package.pickup_code}，取件通知邮件已发送给客户。', 'success')
-            else:
-                flash(f'包裹已标记为到达咖啡馆！取件码: {package.pickup_code}，但邮件发送失败。请检查邮件配置。', 'warning')
+            # 咖啡馆到达通知邮件加入发送队列，与状态变更一起提交
+            enqueue_emails([package.id], 'cafe')
+            db.session.commit()
+            notify_workers()
+            flash(f'包裹已标记为到达咖啡馆！取件码: {package.pickup_code}，取件通知邮件已加入发送队列。', 'success')
             
         except Exception as e:
             db.session.rollback()
@@ -405,92 +312,294 @@ def create_app(config_name='default'):
     
     @app.route('/api/packages')
     def api_packages():
-        """API接口 - 获取所有包裹"""
-        packages = Package.query.all()
-        return jsonify([package.to_dict() for package in packages])
-    
-    @app.route('/api/pickup_codes')
-    def api_pickup_codes():
-        """API接口 - 获取待取件包裹的取件码"""
-        packages = Package.query.filter_by(status='cafe_arrived').order_by(Package.cafe_arrival_date.desc()).all()
-        pickup_data = []
-        
-        for package in packages:
-            pickup_data.append({
-                'id': package.id,
-                'pickup_code': package.pickup_code,
-                'customer_name': package.customer_name,
-                'shenzhen_tracking_number': package.shenzhen_tracking_number,
-                'cafe_arrival_date': package.cafe_arrival_date_paris.strftime('%m-%d %H:%M') if package.cafe_arrival_date_paris else None,
-                'latest_pickup_time': package.latest_pickup_time_paris.strftime('%m-%d %H:%M') if package.latest_pickup_time_paris else None,
-                'is_overdue': package.is_overdue
+        """API接口 - 获取包裹
+
+        参数:
+            fields: 逗号分隔的字段列表，只返回并只加载这些字段
+            updated_since: 只返回该时间（ISO 8601，UTC）之后更新过的包裹
+            after: 游标，返回 id 大于该值的包裹
+            limit: 分页模式，返回 {items, next_after}；不传则流式返回全部结果
+            format: 流式模式下为 ndjson 时逐行输出，否则输出 JSON 数组
+        """
+        try:
+            fields = package_feed.parse_fields(request.args.get('fields'))
+            updated_since = package_feed.parse_updated_since(request.args.get('updated_since'))
+            after = request.args.get('after', type=int)
+            limit = request.args.get('limit', type=int)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+
+        query = package_feed.build_query(fields, after=after, updated_since=updated_since)
+
+        if limit is not None:
+            limit = max(1, min(limit, app.config['API_MAX_PAGE_SIZE']))
+            items, next_after = package_feed.fetch_page(query, fields, limit)
+            return jsonify({
+                'success': True,
+                'items': items,
+                'count': len(items),
+                'next_after': next_after
             })
-        
+
+        batch_size = app.config['API_STREAM_BATCH_SIZE']
+        if request.args.get('format') == 'ndjson':
+            return Response(stream_with_context(package_feed.stream_ndjson(query, fields, batch_size)),
+                            mimetype='application/x-ndjson')
+        return Response(stream_with_context(package_feed.stream_json_array(query, fields, batch_size)),
+                        mimetype='application/json')
+    
+    @app.route('/api/overdue')
+    def api_overdue():
+        """API接口 - 已过最晚取件时间仍未取件的包裹（按最晚取件时间排序）"""
+        limit = request.args.get('limit', 100, type=int)
+        limit = max(1, min(limit, app.config['API_MAX_PAGE_SIZE']))
+        data = overdue_rows(limit)
         return jsonify({
             'success': True,
-            'data': pickup_data,
-            'count': len(pickup_data),
+            'data': data,
+            'count': len(data),
+            'total': Package.query.filter(overdue_filter()).count(),
             'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
         })
     
+    def apply_bulk_transition(identifiers, new_status):
+        """批量变更状态并提交，提交后推送变更、唤醒发件worker，返回 (每项结果, 各结果数量)"""
+        if new_status not in TRANSITIONS:
+            raise ValueError('无效的状态值')
+        if not identifiers:
+            raise ValueError('请提供快递单号或取件码')
+        if len(identifiers) > app.config['BULK_TRANSITION_MAX_ITEMS']:
+            raise ValueError(f"一次最多处理 {app.config['BULK_TRANSITION_MAX_ITEMS']} 个包裹")
+        results, events = bulk_transition(identifiers, new_status)
+        db.session.commit()
+        publish_bulk_changes(events)
+        notify_workers()
+        count_cache.clear()
+        stats_engine.clear()
+        return results, Counter(item['result'] for item in results)
+    
+    @app.route('/api/packages/transition', methods=['POST'])
+    def api_bulk_transition():
+        """API接口 - 按快递单号或取件码批量变更包裹状态
+
+        JSON: {"status": "cafe_arrived" 或 "picked_up", "identifiers": [...]}，
+        也可以用 "text" 传入扫码或粘贴的原始文本。返回每一项的处理结果。
+        """
+        payload = request.get_json(silent=True) or {}
+        identifiers = payload.get('identifiers')
+        if isinstance(identifiers, list):
+            identifiers = list(dict.fromkeys(str(item).strip() for item in identifiers if str(item).strip()))
+        else:
+            identifiers = parse_identifiers(payload.get('text'))
+        try:
+            results, counts = apply_bulk_transition(identifiers, payload.get('status'))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'success': False, 'error': f'更新状态失败: {str(e)}'}), 500
+        return jsonify({
+            'success': True,
+            'status': payload.get('status'),
+            'counts': counts,
+            'results': results
+        })
+    
+    @app.route('/api/mail_stats')
+    def api_mail_stats():
+        """API接口 - 发件队列与SMTP连接池统计"""
+        return jsonify(mail_queue.stats())
+    
+    @app.route('/api/db_stats')
+    def api_db_stats():
+        """API接口 - 数据库连接池统计"""
+        stats = pool_monitor.stats()
+        if stats['dialect'] == 'sqlite':
+            stats['journal_mode'] = db.session.execute(db.text('PRAGMA journal_mode')).scalar()
+        return jsonify(stats)
+    
+    @app.route('/metrics')
+    def metrics_endpoint():
+        """Prometheus 指标（本进程）: 路由耗时、SQL语句数、模板渲染、邮件发送、连接池"""
+        pool = pool_monitor.stats()
+        gauges = {f'db_pool_{name}': (f'数据库连接池 {name}', pool[name])
+                  for name in ('size', 'checkedin', 'checkedout', 'overflow') if name in pool}
+        return Response(metrics.render(gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
+    
+    @app.route('/api/pickup_codes')
+    def api_pickup_codes():
+        """API接口 - 获取待取件包裹的取件码
+
+        返回由数据版本生成的 ETag，数据未变化时直接返回 304，不查询任何包裹行。
+        """
+        version = pickup_codes_version()
+        etag = version_etag(version)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            pickup_data = pickup_codes_rows()
+            last_updated = version[1] or datetime.utcnow()
+            response = jsonify({
+                'success': True,
+                'data': pickup_data,
+                'count': len(pickup_data),
+                'timestamp': last_updated.strftime('%Y-%m-%d %H:%M:%S')
+            })
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
+    
     @app.route('/qr_codes')
     def qr_codes():
-        """二维码页面 - 显示所有取件码的二维码"""
-        # 获取所有有取件码的包裹
-        packages = Package.query.filter(Package.pickup_code.isnot(None)).order_by(Package.cafe_arrival_date.desc().nullslast()).all()
+        """二维码页面 - 显示当前货架上包裹的取件码二维码（更早的见历史记录）"""
+        query = Package.query.filter(active_set_filter(app.config['ACTIVE_SET_RECENT_DAYS']))
+        packages = keyset_paginate(query, app.config['ACTIVE_SET_PAGE_SIZE'],
+                                   after=request.args.get('after', ''), before=request.args.get('before', ''))
+        packages.total = count_cache.get(('active_set',), query.count)
+        present_page(packages)
         
         if not packages:
             flash('目前没有包裹', 'info')
             return redirect(url_for('index'))
         
-        qr_image, qr_text = generate_pickup_codes_qr(packages)
+        qr_key, qr_text = generate_pickup_codes_qr(packages, total=packages.total)
         
         # 提取URL用于显示
         qr_url = qr_text.split('URL: ')[1].split('\n')[0] if 'URL: ' in qr_text else qr_text
         
         return render_template('qr_codes.html', 
-                             qr_image=qr_image, 
+                             qr_key=qr_key, 
                              qr_text=qr_text,
                              qr_url=qr_url,
                              packages=packages)
     
+    @app.route('/qr/<key>.png')
+    def qr_image(key):
+        """缓存的二维码图片，带 ETag，浏览器可长期缓存"""
+        png = qr_cache.get(key)
+        if png is None:
+            return jsonify({'success': False, 'error': '二维码不存在'}), 404
+        response = Response(png, mimetype='image/png')
+        response.set_etag(key)
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config['QR_CACHE_MAX_AGE']
+        return response.make_conditional(request)
+    
+    @app.route('/package/<int:package_id>/qr.png')
+    def package_qr_image(package_id):
+        """单个包裹的二维码图片，首次请求时生成"""
+        row = db.session.query(Package.pickup_code).filter(Package.id == package_id).first()
+        if row is None:
+            return jsonify({'success': False, 'error': '包裹不存在'}), 404
+        key, png = get_package_qr(package_id, row.pickup_code)
+        response = Response(png, mimetype='image/png')
+        response.set_etag(key)
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config['QR_CACHE_MAX_AGE']
+        return response.make_conditional(request)
+    
     @app.route('/mobile_pickup')
     def mobile_pickup():
-        """移动端取件码页面 - 方便店家在手机上查看"""
-        # 获取所有有取件码的包裹
-        packages = Package.query.filter(Package.pickup_code.isnot(None)).order_by(Package.cafe_arrival_date.desc().nullslast()).all()
-        return render_template('mobile_pickup.html', packages=packages)
+        """移动端取件码页面 - 方便店家在手机上查看
+
+        只显示待取件的包裹；页面打开后通过 /api/pickup_codes/stream 接收增量更新，不再整页刷新。
+        扫描包裹二维码打开时带 ?code=取件码，页面只显示该包裹；不是待取件状态时说明原因。
+        """
+        today = to_paris(datetime.utcnow()).strftime('%m-%d')
+        packages = pickup_codes_rows()
+        today_count = sum(1 for package in packages if (package['cafe_arrival_date'] or '').startswith(today))
+        code = request.args.get('code', '').strip()
+        code_error = None
+        if code and active_codes.get(code) is None:
+            _, code_error = inactive_code_reason(code)
+        return render_template('mobile_pickup.html', packages=packages, today=today, today_count=today_count,
+                               code=code, code_error=code_error)
+    
+    @app.route('/api/pickup_codes/stream')
+    def api_pickup_codes_stream():
+        """API接口 - 待取件包裹的变更推送（Server-Sent Events）"""
+        def check_version():
+            version = pickup_codes_version()
+            db.session.close()  # 心跳之间不占用数据库连接
+            return version
+        
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        return Response(stream_with_context(change_feed.stream(last_event_id, check_version)),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    
+    @app.route('/pickup/<code>', methods=['GET', 'POST'])
+    def pickup_by_code(code):
+        """柜台取件 - GET 核对取件码（热缓存），POST 确认取件（原子条件更新，重复确认返回 409）"""
+        code = code.strip()
+        if request.method == 'GET':
+            row = active_codes.get(code)
+            if row is not None:
+                return jsonify({'success': True, 'status': 'cafe_arrived', 'package': active_item(row)})
+        else:
+            try:
+                row = confirm_pickup(code)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                return jsonify({'success': False, 'error': f'确认取件失败: {str(e)}'}), 500
+            if row is not None:
+                publish_bulk_changes([('picked_up', {'id': row.id})])
+                return jsonify({
+                    'success': True,
+                    'status': 'picked_up',
+                    'package': {
+                        'id': row.id,
+                        'pickup_code': code,
+                        'customer_name': row.customer_name,
+                        'shenzhen_tracking_number': row.shenzhen_tracking_number
+                    }
+                })
+        
+        # 不是待取件状态，说明原因
+        package, error = inactive_code_reason(code)
+        if package is None:
+            return jsonify({'success': False, 'error': error}), 404
+        return jsonify({'success': False, 'error': error, 'status': package.status, 'id': package.id}), 409
     
     @app.route('/pickup_cards')
     def pickup_cards():
         """取件码卡片页面 - 方便打印单个取件码"""
         # 获取已到达咖啡馆的包裹
-        packages = Package.query.filter_by(status='cafe_arrived').order_by(Package.cafe_arrival_date.desc()).all()
-        return render_template('pickup_cards.html', packages=packages)
+        query = Package.query.filter_by(status='cafe_arrived')
+        packages = keyset_paginate(query, app.config['ACTIVE_SET_PAGE_SIZE'],
+                                   after=request.args.get('after', ''), before=request.args.get('before', ''))
+        return render_template('pickup_cards.html', packages=present_page(packages))
+    
+    @app.route('/history')
+    def history():
+        """取件历史 - 已取件包裹，服务器端分页"""
+        search = request.args.get('search', '')
+        query = Package.query.filter_by(status='picked_up')
+        if search:
+            query = apply_search(query, search)
+        packages = keyset_paginate(query, app.config['ITEMS_PER_PAGE'],
+                                   after=request.args.get('after', ''), before=request.args.get('before', ''))
+        packages.total = count_cache.get(('picked_up', search), query.count)
+        present_page(packages)
+        return render_template('history.html', packages=packages, search=search)
     
     @app.route('/stats')
     def stats():
         """统计信息页面"""
-        total_packages = Package.query.count()
-        shenzhen_arrived = Package.query.filter_by(status='shenzhen_arrived').count()
-        cafe_arrived = Package.query.filter_by(status='cafe_arrived').count()
-        picked_up = Package.query.filter_by(status='picked_up').count()
-        
-        # 今日数据
-        today = datetime.utcnow().date()
-        today_packages = Package.query.filter(
-            db.func.date(Package.cafe_arrival_date) == today
-        ).count()
-        
-        stats_data = {
-            'total': total_packages,
-            'shenzhen_arrived': shenzhen_arrived,
-            'cafe_arrived': cafe_arrived,
-            'picked_up': picked_up,
-            'today': today_packages
-        }
-        
-        return render_template('stats.html', stats=stats_data)
+        return render_template('stats.html', stats=stats_engine.summary(),
+                               series=stats_engine.series(app.config['STATS_SERIES_DAYS']))
+    
+    @app.route('/api/stats')
+    def api_stats():
+        """API接口 - 状态统计与按天的时间序列（供仪表盘使用）"""
+        days = request.args.get('days', app.config['STATS_SERIES_DAYS'], type=int)
+        return jsonify({
+            'success': True,
+            'summary': stats_engine.summary(),
+            'series': stats_engine.series(days),
+            'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        })
     
     @app.route('/import_template.xlsx')
     def download_import_template():
@@ -500,165 +609,45 @@ def create_app(config_name='default'):
     def import_excel():
         import_result = None
         if request.method == 'POST':
-            file = request.files.get('excel_file')
-            if not file:
-                import_result = {'success': False, 'error': '请选择要上传的文件'}
-                return render_template('import_excel.html', import_result=import_result)
-            
-            if not file.filename:
-                import_result = {'success': False, 'error': '文件名不能为空'}
-                return render_template('import_excel.html', import_result=import_result)
-            
-            if not file.filename.endswith('.xlsx'):
-                import_result = {'success': False, 'error': '请上传xlsx格式的Excel文件'}
-                return render_template('import_excel.html', import_result=import_result)
-            
-            try:
-                # 检查文件是否为空
-                file.seek(0, 2)  # 移动到文件末尾
-                file_size = file.tell()
-                file.seek(0)  # 重置到文件开头
-                
-                if file_size == 0:
-                    import_result = {'success': False, 'error': '上传的文件为空'}
-                    return render_template('import_excel.html', import_result=import_result)
-                
-                # 使用openpyxl读取Excel文件
-                from openpyxl import load_workbook
-                wb = load_workbook(file, data_only=True)
-                ws = wb.active
-                
-                # 获取表头
-                headers = []
-                for cell in ws[1]:
-                    headers.append(str(cell.value).strip() if cell.value else '')
-                
-                required_cols = ['客户名称', '快递单号', '客户邮箱', '备注']
-                missing_cols = [col for col in required_cols if col not in headers]
-                
-                if missing_cols:
-                    import_result = {'success': False, 'error': f'Excel缺少必要列: {", ".join(missing_cols)}，请使用模板'}
-                    return render_template('import_excel.html', import_result=import_result)
-                
-                rows = []
-                ids = []
-                skipped_rows = []
-                
-                # 获取列索引
-                customer_name_idx = headers.index('客户名称')
-                tracking_number_idx = headers.index('快递单号')
-                email_idx = headers.index('客户邮箱')
-                notes_idx = headers.index('备注')
-                
-                # 处理数据行
-                for row_num in range(2, ws.max_row + 1):
-                    customer_name = str(ws.cell(row=row_num, column=customer_name_idx + 1).value or '').strip()
-                    tracking_number = str(ws.cell(row=row_num, column=tracking_number_idx + 1).value or '').strip()
-                    email = str(ws.cell(row=row_num, column=email_idx + 1).value or '').strip()
-                    notes = str(ws.cell(row=row_num, column=notes_idx + 1).value or '').strip()
-                    
-                    if not customer_name or not tracking_number or not email:
-                        continue
-                    
-                    # 检查快递单号是否已存在
-                    existing_package = Package.query.filter_by(shenzhen_tracking_number=tracking_number).first()
-                    if existing_package:
-                        skipped_rows.append({
-                            'customer_name': customer_name,
-                            'tracking_number': tracking_number,
-                            'email': email,
-                            'notes': notes,
-                            'reason': '快递单号已存在'
-                        })
-                        continue
-                    
-                    # 创建包裹
-                    package = Package(
-                        customer_name=customer_name,
-                        shenzhen_tracking_number=tracking_number,
-                        customer_email=email,
-                        notes=notes,
-                        pickup_code=Package.generate_pickup_code()  # 生成取件码
-                    )
-                    db.session.add(package)
-                    db.session.flush()  # 获取ID
-                    ids.append(package.id)
-                    rows.append({
-                        'customer_name': customer_name,
-                        'tracking_number': tracking_number,
-                        'email': email,
-                        'notes': notes
-                    })
-                db.session.commit()
-                import_result = {
-                    'success': True, 
-                    'count': len(rows), 
-                    'rows': rows, 
-                    'ids': ids,
-                    'skipped_count': len(skipped_rows),
-                    'skipped_rows': skipped_rows
-                }
-            except Exception as e:
-                db.session.rollback()
-                error_msg = str(e)
-                if "File is not a zip file" in error_msg:
-                    import_result = {'success': False, 'error': '文件格式错误：请确保上传的是有效的Excel文件(.xlsx)，不是其他格式的文件'}
-                elif "No sheet names" in error_msg:
-                    import_result = {'success': False, 'error': 'Excel文件没有工作表，请检查文件内容'}
-                else:
-                    import_result = {'success': False, 'error': f'导入失败: {error_msg}'}
+            import_result = import_excel_file(request.files.get('excel_file'))
         return render_template('import_excel.html', import_result=import_result)
 
     @app.route('/import_excel_send', methods=['POST'])
     def import_excel_send():
         ids = request.form.get('import_ids', '')
         id_list = [int(i) for i in ids.split(',') if i.isdigit()]
-        packages = Package.query.filter(Package.id.in_(id_list)).all()
-        mail = Mail(app)
-        success, fail = 0, 0
-        for package in packages:
-            if send_shenzhen_arrival_email(package, mail):
-                success += 1
-            else:
-                fail += 1
-        flash(f'群发完成，成功 {success} 条，失败 {fail} 条', 'success' if fail == 0 else 'warning')
+        queued = enqueue_emails(id_list, 'shenzhen')
+        db.session.commit()
+        notify_workers()
+        flash(f'已将 {queued} 条深圳到达邮件加入发送队列，将在后台发送', 'success')
         return redirect(url_for('import_excel'))
 
     @app.route('/send_shenzhen_emails', methods=['POST'])
     def send_shenzhen_emails():
         """发送所有待发送的深圳到达邮件"""
         try:
-            mail = Mail(app)
-            count = 0
-            
             # 查找需要发送深圳到达邮件的包裹
-            shenzhen_packages = Package.query.filter_by(
+            package_ids = [package_id for (package_id,) in db.session.query(Package.id).filter_by(
                 status='shenzhen_arrived',
                 shenzhen_email_sent=False
-            ).all()
-            
-            # 异步发送所有邮件
-            def send_bulk_shenzhen_emails():
-                nonlocal count
-                for package in shenzhen_packages:
-                    if send_shenzhen_arrival_email(package, mail):
-                        count += 1
-                logging.info(f'批量深圳邮件发送完成，成功: {count} 条')
+            )]
             
-            thread = threading.Thread(target=send_bulk_shenzhen_emails)
-            thread.daemon = True
-            thread.start()
+            # 加入发送队列，由后台worker发送
+            queued = enqueue_emails(package_ids, 'shenzhen')
+            db.session.commit()
+            notify_workers()
             
             # 立即返回结果
             session['shenzhen_email_result'] = {
                 'success': True,
-                'count': len(shenzhen_packages),
-                'message': f'正在后台发送 {len(shenzhen_packages)} 条深圳邮件'
+                'count': queued,
+                'message': f'已将 {queued} 条深圳邮件加入发送队列，正在后台发送'
             }
             
             return redirect(url_for('index'))
             
         except Exception as e:
+            db.session.rollback()
             session['shenzhen_email_result'] = {
                 'success': False,
                 'error': f'发送深圳邮件时发生错误: {str(e)}'
@@ -669,37 +658,28 @@ def create_app(config_name='default'):
     def send_cafe_emails():
         """发送所有待发送的咖啡馆到达邮件"""
         try:
-            mail = Mail(app)
-            count = 0
-            
             # 查找需要发送咖啡馆到达邮件的包裹
-            cafe_packages = Package.query.filter_by(
+            package_ids = [package_id for (package_id,) in db.session.query(Package.id).filter_by(
                 status='cafe_arrived',
                 cafe_email_sent=False
-            ).all()
+            )]
             
-            # 异步发送所有邮件
-            def send_bulk_cafe_emails():
-                nonlocal count
-                for package in cafe_packages:
-                    if send_cafe_arrival_email(package, mail):
-                        count += 1
-                logging.info(f'批量咖啡馆邮件发送完成，成功: {count} 条')
-            
-            thread = threading.Thread(target=send_bulk_cafe_emails)
-            thread.daemon = True
-            thread.start()
+            # 加入发送队列，由后台worker发送
+            queued = enqueue_emails(package_ids, 'cafe')
+            db.session.commit()
+            notify_workers()
             
             # 立即返回结果
             session['cafe_email_result'] = {
                 'success': True,
-                'count': len(cafe_packages),
-                'message': f'正在后台发送 {len(cafe_packages)} 条咖啡馆邮件'
+                'count': queued,
+                'message': f'已将 {queued} 条咖啡馆邮件加入发送队列，正在后台发送'
             }
             
             return redirect(url_for('index'))
             
         except Exception as e:
+            db.session.rollback()
             session['cafe_email_result'] = {
                 'success': False,
                 'error': f'发送咖啡馆邮件时发生错误: {str(e)}'
@@ -715,6 +695,9 @@ def create_app(config_name='default'):
             tracking_number = package.shenzhen_tracking_number
             
             db.session.delete(package)
+            release_pickup_codes([package.pickup_code])
+            EmailJob.query.filter_by(package_id=package_id).delete(synchronize_session=False)
+            delete_package_qrs([package_id])
             db.session.commit()
             
             flash(f'包裹已删除：客户 {customer_name}，快递单号 {tracking_number}', 'success')
@@ -725,6 +708,25 @@ def create_app(config_name='default'):
             flash(f'删除包裹失败: {str(e)}', 'error')
             return redirect(url_for('package_detail', package_id=package_id))
     
+    @app.route('/bulk_status', methods=['GET', 'POST'])
+    def bulk_status():
+        """批量扫码入库/取件：粘贴或扫描快递单号、取件码，一次变更状态"""
+        new_status = request.form.get('status', 'cafe_arrived')
+        text = request.form.get('identifiers', '')
+        results, counts = None, None
+        if request.method == 'POST':
+            try:
+                results, counts = apply_bulk_transition(parse_identifiers(text), new_status)
+                flash(f"已更新 {counts['updated']} 个包裹", 'success' if counts['updated'] else 'info')
+                text = ''
+            except ValueError as e:
+                flash(str(e), 'error')
+            except Exception as e:
+                db.session.rollback()
+                flash(f'更新状态失败: {str(e)}', 'error')
+        return render_template('bulk_status.html', status=new_status, identifiers=text,
+                               results=results, counts=counts, status_display=STATUS_DISPLAY)
+    
     @app.route('/delete_all_packages', methods=['POST'])
     def delete_all_packages():
         """删除所有包裹（危险操作）"""
@@ -738,27 +740,25 @@ def create_app(config_name='default'):
                 flash('确认文本不正确，请输入 "DELETE ALL" 来确认删除', 'error')
                 return redirect(url_for('index'))
             
-            # 构建查询
-            query = Package.query
-            if status_filter:
-                query = query.filter_by(status=status_filter)
-            
-            # 获取要删除的包裹数量
-            packages_to_delete = query.all()
-            count = len(packages_to_delete)
+            # 分块删除，不把所有包裹加载到内存
+            condition = Package.status == status_filter if status_filter else None
+            archive = bool(request.form.get('archive'))
+            count = bulk_delete_packages(
+                condition, archive=archive,
+                chunk_size=app.config['BULK_DELETE_CHUNK_SIZE'],
+                progress=lambda done, total, elapsed: app.logger.info(
+                    f"批量删除进度: {done}/{total}，{elapsed:.1f} 秒")
+            )
             
             if count == 0:
                 flash('没有找到要删除的包裹', 'info')
                 return redirect(url_for('index'))
-            
-            # 删除包裹
-            for package in packages_to_delete:
-                db.session.delete(package)
-            
-            db.session.commit()
+            count_cache.clear()
+            stats_engine.clear()
             
             status_text = f'状态为 {status_filter} 的' if status_filter else '所有'
-            flash(f'已删除 {count} 个{status_text}包裹', 'success')
+            archive_text = '，已归档到 package_archive 表' if archive else ''
+            flash(f'已删除 {count} 个{status_text}包裹{archive_text}', 'success')
             return redirect(url_for('index'))
             
         except Exception as e:
@@ -784,13 +784,9 @@ def create_app(config_name='default'):
             # 如果是标记为到达咖啡馆
             if new_status == 'cafe_arrived' and old_status != 'cafe_arrived':
                 package.cafe_arrival_date = datetime.utcnow()
-                # 同步发送咖啡馆到达邮件
-                mail = Mail(app)
-                success = send_cafe_arrival_email(package, mail)
-                if success:
-                    flash(f'✅ 包裹已标记为到达咖啡馆！取件码: {package.pickup_code}，取件通知邮件发送成功。', 'success')
-                else:
-                    flash(f'⚠️ 包裹已标记为到达咖啡馆！取件码: {package.pickup_code}，但邮件发送失败。', 'warning')
+                # 咖啡馆到达邮件加入发送队列，与状态变更一起提交
+                enqueue_emails([package.id], 'cafe')
+                flash(f'✅ 包裹已标记为到达咖啡馆！取件码: {package.pickup_code}，取件通知邮件已加入发送队列。', 'success')
             
             # 如果是标记为已取件
             elif new_status == 'picked_up' and old_status != 'picked_up':
@@ -798,6 +794,7 @@ def create_app(config_name='default'):
                 flash(f'包裹已标记为已取件！客户: {package.customer_name}', 'success')
             
             db.session.commit()
+            notify_workers()
             
         except Exception as e:
             db.session.rollback()
@@ -819,16 +816,14 @@ def create_app(config_name='default'):
                 flash('深圳到达邮件已经发送过了', 'info')
                 return redirect(url_for('index'))
             
-            # 同步发送邮件（立即更新状态）
-            mail = Mail(app)
-            success = send_shenzhen_arrival_email(package, mail)
-            
-            if success:
-                flash(f'✅ 深圳到达邮件发送成功！客户: {package.customer_name}', 'success')
-            else:
-                flash(f'❌ 深圳到达邮件发送失败！客户: {package.customer_name}', 'error')
+            # 加入发送队列，由后台worker发送
+            enqueue_emails([package.id], 'shenzhen', force=True)
+            db.session.commit()
+            notify_workers()
+            flash(f'✅ 深圳到达邮件已加入发送队列！客户: {package.customer_name}', 'success')
             
         except Exception as e:
+            db.session.rollback()
             flash(f'发送邮件时发生错误: {str(e)}', 'error')
         
         return redirect(url_for('index'))
@@ -843,16 +838,14 @@ def create_app(config_name='default'):
                 flash('只有已到咖啡馆的包裹才能发送咖啡馆到达邮件', 'warning')
                 return redirect(url_for('index'))
             
-            # 同步发送邮件（立即更新状态）
-            mail = Mail(app)
-            success = send_cafe_arrival_email(package, mail)
-            
-            if success:
-                flash(f'✅ 咖啡馆到达邮件发送成功！客户: {package.customer_name}，取件码: {package.pickup_code}', 'success')
-            else:
-                flash(f'❌ 咖啡馆到达邮件发送失败！客户: {package.customer_name}', 'error')
+            # 加入发送队列，由后台worker发送
+            enqueue_emails([package.id], 'cafe', force=True)
+            db.session.commit()
+            notify_workers()
+            flash(f'✅ 咖啡馆到达邮件已加入发送队列！客户: {package.customer_name}，取件码: {package.pickup_code}', 'success')
             
         except Exception as e:
+            db.session.rollback()
             flash(f'发送邮件时发生错误: {str(e)}', 'error')
         
         return redirect(url_for('index'))
@@ -861,11 +854,28 @@ def create_app(config_name='default'):
     
     return app
 
+def init_database(app):
+    """创建数据表，并为旧数据库补齐新增的列、索引、搜索索引和日汇总"""
+    with app.app_context():
+        db.create_all()
+        ensure_columns()
+        ensure_indexes()
+        ensure_search_index()
+        ensure_daily_stats()
+
+
+def precompile_templates(app):
+    """编译全部模板（含邮件模板），结果写入字节码缓存并留在 Jinja 环境的缓存中，返回模板数量"""
+    names = app.jinja_env.list_templates(extensions=['html', 'txt'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
 if __name__ == '__main__':
     app = create_app()
     
     # 创建数据库表（仅在开发环境）
-    with app.app_context():
-        db.create_all()
+    init_database(app)
     
-    app.run(debug=app.config['DEBUG'], host='0.0.0.0', port=5000) 
\ No newline at end of file
+    app.run(debug=app.config['DEBUG'], host='0.0.0.0', port=5000)
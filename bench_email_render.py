@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+邮件渲染基准测试
+对比逐封 render_template 与批量渲染器（预编译模板 + 静态骨架）每秒渲染的邮件数
+用法: python bench_email_render.py [包裹数量，默认10000]
+"""
+
+import sys
+import time
+from datetime import datetime
+
+from flask import render_template
+from app import create_app
+from models import Package
+from email_render import EmailRenderer
+
+
+def make_packages(count):
+    """构造不入库的测试包裹"""
+    now = datetime.utcnow()
+    return [
+        Package(
+            id=i,
+            customer_name=f'客户{i}',
+            customer_email=f'customer{i}@example.com',
+            shenzhen_tracking_number=f'SF{1000000000 + i}',
+            pickup_code=f'{i % 1000000:06d}',
+            status='cafe_arrived',
+            cafe_arrival_date=now,
+        )
+        for i in range(count)
+    ]
+
+
+def bench(label, packages, render_one):
+    started = time.perf_counter()
+    for package in packages:
+        render_one(package)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<32} {elapsed:8.2f}s  {len(packages) / elapsed:10.0f} 封/秒")
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    app = create_app('testing')
+    packages = make_packages(count)
+
+    with app.app_context():
+        compiled = EmailRenderer(app, use_skeleton=False)
+        skeleton = EmailRenderer(app, use_skeleton=True)
+
+        print(f"渲染 {count} 封邮件")
+        print("-" * 60)
+        for name, extra in [('email/shenzhen_arrival.html', {}),
+                            ('email/cafe_arrival.html', {})]:
+            print(name)
+            bench('  render_template (逐封)', packages,
+                  lambda p: render_template(name, package=p, **extra))
+            bench('  预编译模板', packages,
+                  lambda p: compiled.render(name, p, **extra))
+            bench('  预编译模板 + 静态骨架', packages,
+                  lambda p: skeleton.render(name, p, **extra))
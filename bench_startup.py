@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+启动时间基准测试（模拟 Render 实例休眠后的冷启动）
+每轮在新的 Python 进程中测量: 导入 app、create_app、初始化数据库、第一个请求的耗时，
+并用 -X importtime 检查启动时没有导入只在个别功能中才用到的重量级依赖。
+超出导入时间预算或导入了这些依赖时以非0状态退出，可用于持续集成。
+用法: python bench_startup.py [--runs 5] [--budget-ms 1000]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# 启动时不应导入的模块：只有生成二维码、导入Excel、校验邮箱时才需要
+DEFERRED_MODULES = ('qrcode', 'PIL', 'openpyxl', 'email_validator', 'pandas')
+
+COLD_START = '''
+import json, time
+t0 = time.perf_counter()
+from app import create_app, init_database
+t1 = time.perf_counter()
+app = create_app('testing')
+t2 = time.perf_counter()
+init_database(app)
+t3 = time.perf_counter()
+response = app.test_client().get('/')
+t4 = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({'import': t1 - t0, 'create_app': t2 - t1, 'init_database': t3 - t2,
+                  'first_request': t4 - t3, 'total': t4 - t0}))
+'''
+
+
+def run_python(args, env):
+    return subprocess.run([sys.executable] + args, capture_output=True, text=True, env=env,
+                          cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+
+
+def import_profile(env):
+    """-X importtime: 返回 (导入 app 的累计微秒数, 导入的模块名集合)"""
+    result = run_python(['-X', 'importtime', '-c', 'import app'], env)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative)
+    return modules.get('app', 0), set(modules)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='冷启动时间基准测试')
+    parser.add_argument('--runs', type=int, default=5, help='测量轮数')
+    parser.add_argument('--budget-ms', type=float, default=1000, help='导入 app 的时间预算（毫秒）')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{os.path.join(tmp, "bench.db")}',
+                   QR_CACHE_DIR=os.path.join(tmp, 'qr_cache'))
+        # TestingConfig 默认使用内存数据库，这里改用临时文件数据库
+        bootstrap = "from config import TestingConfig, Config; TestingConfig.SQLALCHEMY_DATABASE_URI = Config.SQLALCHEMY_DATABASE_URI\n"
+
+        runs = []
+        for _ in range(args.runs):
+            result = run_python(['-c', bootstrap + COLD_START], env)
+            runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+        import_us, modules = import_profile(env)
+
+    print(f"冷启动 {args.runs} 轮（中位数）")
+    print("-" * 40)
+    for key in ('import', 'create_app', 'init_database', 'first_request', 'total'):
+        print(f"{key:<16} {statistics.median(run[key] for run in runs) * 1000:8.1f} ms")
+    print("-" * 40)
+    print(f"-X importtime: import app {import_us / 1000:.1f} ms（预算 {args.budget_ms:.0f} ms）")
+
+    failed = False
+    loaded = [name for name in DEFERRED_MODULES if name in modules]
+    if loaded:
+        print(f"❌ 启动时导入了应延迟加载的模块: {', '.join(loaded)}")
+        failed = True
+    if import_us / 1000 > args.budget_ms:
+        print("❌ 导入时间超出预算")
+        failed = True
+    if not failed:
+        print("✅ 启动时间在预算内")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+import logging
+import re
+import time
+from datetime import datetime
+from flask import current_app, has_app_context
+from models import db, Package, PackageArchive, EmailJob, pickup_hold
+from pickup_codes import release_pickup_codes
+from package_qr import delete_package_qrs
+from pickup_feed import pickup_item
+from mail_queue import enqueue_emails
+from stats_engine import new_counters, count_transition, record_transitions
+
+logger = logging.getLogger(__name__)
+
+FEED_EVENT_LIMIT = 100  # 一次推送的事件超过此数量时改为通知客户端整体刷新
+QUERY_CHUNK_SIZE = 500  # IN 查询每批的参数个数，兼容SQLite参数上限
+# 批量状态变更: 目标状态 -> 允许的原状态
+TRANSITIONS = {
+    'cafe_arrived': ('shenzhen_arrived',),
+    'picked_up': ('shenzhen_arrived', 'cafe_arrived'),
+}
+
+
+def publish_bulk_changes(events):
+    """绕过ORM的批量变更不会触发 change_feed 的 session 钩子，提交后调用此函数推送事件"""
+    if not events or not has_app_context():
+        return
+    feed = current_app.extensions.get('change_feed')
+    if feed is None:
+        return
+    if len(events) > FEED_EVENT_LIMIT:
+        events = [('resync', {})]
+    feed.publish(events)
+
+
+def bulk_delete_packages(condition=None, archive=False, chunk_size=500, progress=None):
+    """按条件分块删除包裹，不加载ORM对象
+
+    按 id 顺序每次取一块 (id, 取件码, 状态)，可选先复制到 package_archive，再删除包裹及其
+    邮件任务和二维码、回收取件码并提交；中断后已完成的块保持删除状态。
+    progress(done, total, elapsed) 在每块提交后调用。返回删除数量。
+    """
+    table = Package.__table__
+    query = db.session.query(Package.id, Package.pickup_code, Package.status)
+    if condition is not None:
+        query = query.filter(condition)
+    total = query.count()
+    if total == 0:
+        return 0
+
+    columns = ['package_id' if column.name == 'id' else column.name for column in table.columns]
+    archive_stmt = PackageArchive.__table__.insert().from_select(
+        columns + ['archived_at'],
+        db.select(*table.columns, db.bindparam('archived_at', type_=db.DateTime))
+        .where(table.c.id.in_(db.bindparam('ids', expanding=True)))
+    )
+    start = time.monotonic()
+    done = 0
+    last_id = 0
+    while True:
+        rows = query.filter(Package.id > last_id).order_by(Package.id).limit(chunk_size).all()
+        if not rows:
+            break
+        ids = [package_id for package_id, _, _ in rows]
+        if archive:
+            db.session.execute(archive_stmt, {'ids': ids, 'archived_at': datetime.utcnow()})
+        db.session.execute(table.delete().where(table.c.id.in_(ids)))
+        db.session.execute(db.delete(EmailJob).where(EmailJob.package_id.in_(ids))
+                           .execution_options(synchronize_session=False))
+        delete_package_qrs(ids)
+        release_pickup_codes([code for _, code, _ in rows])
+        db.session.commit()
+        publish_bulk_changes([('deleted', {'id': package_id})
+                              for package_id, _, status in rows if status == 'cafe_arrived'])
+
+        done += len(rows)
+        last_id = ids[-1]
+        if progress:
+            progress(done, total, time.monotonic() - start)
+
+    logger.info(f"批量删除 {done} 个包裹{'（已归档）' if archive else ''}，耗时 {time.monotonic() - start:.1f} 秒")
+    return done
+
+
+def parse_identifiers(text):
+    """把扫码或粘贴的文本拆分为快递单号/取件码列表（按空白、逗号、分号分隔，去重并保持顺序）"""
+    return list(dict.fromkeys(item for item in re.split(r'[\s,;，；]+', text or '') if item))
+
+
+def _resolve_identifiers(identifiers):
+    """identifier -> (id, 状态)，先按深圳快递单号匹配，再按取件码匹配"""
+    resolved = {}
+    for column in (Package.shenzhen_tracking_number, Package.pickup_code):
+        pending = [identifier for identifier in identifiers if identifier not in resolved]
+        for i in range(0, len(pending), QUERY_CHUNK_SIZE):
+            rows = db.session.query(column, Package.id, Package.status) \
+                .filter(column.in_(pending[i:i + QUERY_CHUNK_SIZE]))
+            for identifier, package_id, status in rows:
+                resolved.setdefault(identifier, (package_id, status))
+    return resolved
+
+
+def bulk_transition(identifiers, new_status):
+    """按快递单号或取件码批量变更包裹状态
+
+    每批一条 UPDATE ... WHERE id IN (...) AND status IN (允许的原状态) RETURNING，
+    到达咖啡馆的取件通知邮件在同一事务中一次入队，日汇总计数和移动端推送也一并处理。
+    提交由调用方负责，提交后再调用 publish_bulk_changes(events) 和 notify_workers()。
+    返回 (每项结果列表, 待推送事件列表)，结果按输入顺序，result 为
+    updated / unchanged（已是目标状态）/ invalid（当前状态不允许变更）/ not_found。
+    """
+    if new_status not in TRANSITIONS:
+        raise ValueError(f'不支持的目标状态: {new_status}')
+
+    allowed = TRANSITIONS[new_status]
+    resolved = _resolve_identifiers(identifiers)
+    previous = dict(resolved.values())  # id -> 原状态
+    candidate_ids = [package_id for package_id, status in previous.items() if status in allowed]
+
+    now = datetime.utcnow()
+    values = {'status': new_status, 'updated_at': now}
+    if new_status == 'cafe_arrived':
+        values.update(cafe_arrival_date=now, pickup_deadline=now + pickup_hold())
+    else:
+        values['pickup_date'] = now
+
+    table = Package.__table__
+    updated = {}
+    for i in range(0, len(candidate_ids), QUERY_CHUNK_SIZE):
+        result = db.session.execute(
+            table.update()
+            .where(table.c.id.in_(candidate_ids[i:i + QUERY_CHUNK_SIZE]), table.c.status.in_(allowed))
+            .values(values)
+            .returning(table.c.id, table.c.pickup_code, table.c.customer_name,
+                       table.c.shenzhen_tracking_number, table.c.cafe_arrival_date, table.c.pickup_deadline)
+        )
+        for row in result:
+            updated[row.id] = row
+
+    counters = new_counters()
+    events = []
+    for package_id, row in updated.items():
+        status = previous[package_id]
+        count_transition(counters, status, new_status, row.pickup_deadline, now, now)
+        if new_status == 'cafe_arrived':
+            events.append(('arrived', pickup_item(*row, False)))
+        elif status == 'cafe_arrived':
+            events.append(('picked_up', {'id': package_id}))
+    record_transitions(counters)
+    if new_status == 'cafe_arrived' and updated:
+        enqueue_emails(list(updated), 'cafe')
+
+    results = []
+    for identifier in identifiers:
+        if identifier not in resolved:
+            results.append({'identifier': identifier, 'result': 'not_found'})
+            continue
+        package_id, status = resolved[identifier]
+        row = updated.get(package_id)
+        if row is not None:
+            result = 'updated'
+        elif status == new_status:
+            result = 'unchanged'
+        else:
+            result = 'invalid'
+        results.append({
+            'identifier': identifier,
+            'id': package_id,
+            'result': result,
+            'previous_status': status,
+            'pickup_code': row.pickup_code if row is not None else None,
+            'customer_name': row.customer_name if row is not None else None,
+        })
+    return results, events
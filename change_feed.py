@@ -0,0 +1,177 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from models import Package
+from pickup_feed import package_pickup_item
+
+logger = logging.getLogger(__name__)
+
+DISPLAY_FIELDS = ('pickup_code', 'customer_name', 'shenzhen_tracking_number', 'cafe_arrival_date')
+
+
+class ChangeFeed:
+    """待取件包裹的进程内变更事件总线，通过 SSE 推送给移动端页面
+
+    事件在事务提交后发布: arrived / updated（带包裹数据）、picked_up / removed / deleted（只带 id）。
+    其他进程（多worker部署）中的变更无法直接收到，由心跳时比较数据版本发现并推送 resync；
+    版本变化时无法区分本进程和其他进程的提交，因此推送过本进程事件的周期也会推送 resync。
+    """
+
+    def __init__(self, app=None):
+        self.epoch = uuid.uuid4().hex[:8]  # 进程重启后旧的事件编号失效
+        self.heartbeat = 15
+        self.max_duration = 300
+        self._events = deque(maxlen=1000)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._subscribers = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.heartbeat = app.config.get('CHANGE_FEED_HEARTBEAT', 15)
+        self.max_duration = app.config.get('CHANGE_FEED_MAX_DURATION', 300)
+        self._events = deque(maxlen=app.config.get('CHANGE_FEED_BUFFER', 1000))
+        app.extensions['change_feed'] = self
+
+    def after_fork(self):
+        """在 fork 出的工作进程中调用：每个进程使用自己的事件编号，客户端重连到其他进程时会触发 resync"""
+        self.epoch = uuid.uuid4().hex[:8]
+        self._events.clear()
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def subscribe(self, callback):
+        """注册进程内订阅者，每次发布时以事件列表调用 callback(events)（用于失效本地缓存）"""
+        self._subscribers.append(callback)
+
+    def publish(self, events):
+        """发布 [(事件类型, 数据), ...]"""
+        if not events:
+            return
+        with self._cond:
+            for event_type, data in events:
+                self._seq += 1
+                self._events.append((self._seq, event_type, data))
+            self._cond.notify_all()
+        for callback in self._subscribers:
+            try:
+                callback(events)
+            except Exception as e:
+                logger.error(f"变更订阅者处理失败: {str(e)}")
+
+    def _since(self, seq):
+        """seq 之后的事件；seq 已不在缓冲区内时返回 None"""
+        if seq < self._seq and (not self._events or self._events[0][0] > seq + 1):
+            return None
+        return [item for item in self._events if item[0] > seq]
+
+    def wait(self, seq, timeout):
+        """等待 seq 之后的事件，超时返回空列表"""
+        with self._cond:
+            if self._seq == seq:
+                self._cond.wait(timeout)
+            return self._since(seq)
+
+    def _parse_event_id(self, last_event_id):
+        """解析客户端的 Last-Event-ID（格式 epoch:seq），不属于本进程时返回 None"""
+        try:
+            epoch, seq = last_event_id.split(':')
+            seq = int(seq)
+        except (AttributeError, ValueError):
+            return None
+        if epoch != self.epoch or seq > self._seq:
+            return None
+        return seq
+
+    def _format(self, seq, event_type, data):
+        return f"id: {self.epoch}:{seq}\nevent: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    def stream(self, last_event_id, check_version):
+        """SSE 事件流生成器
+
+        check_version() 返回当前数据版本，用于发现其他进程中的变更。连接最长保持 max_duration 秒，
+        之后由 EventSource 带 Last-Event-ID 自动重连，避免长期占用工作线程。
+        """
+        # version 是客户端当前数据对应的版本。通知客户端重新加载（resync）之前先读取版本，
+        # 客户端随后加载到的数据一定不早于该版本
+        version = check_version()
+        seq = self._parse_event_id(last_event_id)
+        yield "retry: 3000\n\n"
+        if seq is None:
+            seq = self._seq
+            if last_event_id:
+                yield self._format(seq, 'resync', {})
+
+        deadline = time.monotonic() + self.max_duration
+        next_check = time.monotonic() + self.heartbeat
+        while time.monotonic() < deadline:
+            events = self.wait(seq, max(next_check - time.monotonic(), 0))
+            if events is None:
+                # 客户端落后太多，缓冲区中的事件已被覆盖
+                version = check_version()
+                seq = self._seq
+                yield self._format(seq, 'resync', {})
+                continue
+            if events:
+                for item_seq, event_type, data in events:
+                    yield self._format(item_seq, event_type, data)
+                seq = events[-1][0]
+            if time.monotonic() < next_check:
+                continue
+
+            # 每个心跳周期比较一次版本（事件持续不断时也一样）。版本变化可能包含其他进程的提交，
+            # 本进程推送过的事件无法排除这种可能，因此只要版本变化就通知客户端重新加载
+            next_check = time.monotonic() + self.heartbeat
+            current = check_version()
+            if current != version:
+                version = current
+                yield self._format(seq, 'resync', {})
+            yield ": keepalive\n\n"
+
+
+def _collect_changes(session, flush_context):
+    """flush 后根据包裹状态变化生成事件，暂存到 session.info，提交后发布"""
+    changes = session.info.setdefault('pickup_changes', [])
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Package):
+            continue
+        state = inspect(obj)
+        history = state.attrs.status.history
+        if history.added:
+            old_status = history.deleted[0] if history.deleted else None
+            new_status = history.added[0]
+        else:
+            old_status = new_status = obj.status
+        if new_status == 'cafe_arrived' and old_status != 'cafe_arrived':
+            changes.append(('arrived', package_pickup_item(obj)))
+        elif old_status == 'cafe_arrived' and new_status != 'cafe_arrived':
+            changes.append(('picked_up' if new_status == 'picked_up' else 'removed', {'id': obj.id}))
+        elif new_status == 'cafe_arrived' and any(state.attrs[name].history.has_changes() for name in DISPLAY_FIELDS):
+            changes.append(('updated', package_pickup_item(obj)))
+    for obj in session.deleted:
+        if isinstance(obj, Package):
+            changes.append(('deleted', {'id': obj.id}))
+
+
+def _publish_changes(session):
+    changes = session.info.pop('pickup_changes', None)
+    if changes and has_app_context():
+        feed = current_app.extensions.get('change_feed')
+        if feed is not None:
+            feed.publish(changes)
+
+
+def _discard_changes(session):
+    session.info.pop('pickup_changes', None)
+
+
+event.listen(Session, 'after_flush', _collect_changes)
+event.listen(Session, 'after_commit', _publish_changes)
+event.listen(Session, 'after_soft_rollback', lambda session, previous_transaction: _discard_changes(session))
@@ -11,6 +11,15 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///orders.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # 数据库连接池配置（SQLite 内存数据库不使用）
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 5)  # 每个进程保持的连接数
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 10)  # 繁忙时额外允许的连接数
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT') or 10)  # 等待空闲连接的最长时间（秒）
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE') or 1800)  # 连接最长使用时间（秒），避免被服务器端断开
+    DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT') or 30000)  # PostgreSQL 单条语句超时（毫秒），0 表示不限制
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 5000)  # SQLite 写锁等待时间（毫秒）
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE') or 256 * 1024 * 1024)  # SQLite 内存映射读取大小（字节）
+    
     # 邮件配置
     MAIL_SERVER = os.environ.get('MAIL_SERVER') or 'smtp.163.com'
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
@@ -19,15 +28,60 @@ class Config:
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     
+    # 发件队列配置
+    MAIL_QUEUE_WORKERS = int(os.environ.get('MAIL_QUEUE_WORKERS') or 2)  # 每个进程的发件worker数
+    MAIL_QUEUE_BATCH_SIZE = int(os.environ.get('MAIL_QUEUE_BATCH_SIZE') or 20)  # worker每次领取的任务数
+    MAIL_QUEUE_POLL_INTERVAL = int(os.environ.get('MAIL_QUEUE_POLL_INTERVAL') or 5)  # 空闲时轮询间隔（秒）
+    MAIL_QUEUE_LEASE = int(os.environ.get('MAIL_QUEUE_LEASE') or 300)  # 发送中任务超时回收（秒）
+    MAIL_MAX_ATTEMPTS = int(os.environ.get('MAIL_MAX_ATTEMPTS') or 5)  # 最大重试次数
+    MAIL_RETRY_BACKOFF = int(os.environ.get('MAIL_RETRY_BACKOFF') or 30)  # 重试退避基数（秒），按2的幂增长
+    MAIL_MAX_EMAILS = int(os.environ.get('MAIL_MAX_EMAILS') or 100)  # 单个SMTP会话最多发送的邮件数，达到后重连
+    MAIL_POOL_IDLE_TIMEOUT = int(os.environ.get('MAIL_POOL_IDLE_TIMEOUT') or 60)  # SMTP长连接最大空闲时间（秒）
+    EMAIL_SKELETON_CACHE = os.environ.get('EMAIL_SKELETON_CACHE', 'true').lower() == 'true'  # 缓存纯字段替换邮件模板的静态骨架
+    
     # 应用配置
     ITEMS_PER_PAGE = 20
+    PICKUP_HOLD_DAYS = int(os.environ.get('PICKUP_HOLD_DAYS') or 7)  # 到达咖啡馆后的保留天数（只影响之后到达的包裹）
+    ACTIVE_SET_RECENT_DAYS = int(os.environ.get('ACTIVE_SET_RECENT_DAYS') or 3)  # 已取件包裹在货架视图中保留的天数
+    ACTIVE_SET_PAGE_SIZE = int(os.environ.get('ACTIVE_SET_PAGE_SIZE') or 50)  # 二维码、取件卡片页每页数量
+    COUNT_CACHE_TTL = int(os.environ.get('COUNT_CACHE_TTL') or 30)  # 列表总数缓存时间（秒）
+    STATS_CACHE_TTL = int(os.environ.get('STATS_CACHE_TTL') or 30)  # 统计数据缓存时间（秒）
+    STATS_SERIES_DAYS = int(os.environ.get('STATS_SERIES_DAYS') or 30)  # 统计时间序列默认天数
+    QR_CACHE_SIZE = int(os.environ.get('QR_CACHE_SIZE') or 128)  # 进程内缓存的二维码图片数
+    QR_CACHE_DIR = os.environ.get('QR_CACHE_DIR')  # 二维码磁盘缓存目录，默认 instance/qr_cache
+    QR_CACHE_MAX_AGE = int(os.environ.get('QR_CACHE_MAX_AGE') or 86400)  # 浏览器缓存时间（秒）
+    CHANGE_FEED_HEARTBEAT = int(os.environ.get('CHANGE_FEED_HEARTBEAT') or 15)  # 变更推送心跳间隔（秒）
+    CHANGE_FEED_MAX_DURATION = int(os.environ.get('CHANGE_FEED_MAX_DURATION') or 300)  # 单个推送连接最长时间（秒）
+    CHANGE_FEED_BUFFER = int(os.environ.get('CHANGE_FEED_BUFFER') or 1000)  # 保留的最近事件数，用于断线重连补发
+    PICKUP_CACHE_TTL = int(os.environ.get('PICKUP_CACHE_TTL') or 60)  # 柜台取件码热缓存整体重新加载的间隔（秒）
+    API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE') or 1000)  # /api/packages 每页上限
+    API_STREAM_BATCH_SIZE = int(os.environ.get('API_STREAM_BATCH_SIZE') or 500)  # 流式输出每批取行数
     DEBUG = os.environ.get('FLASK_DEBUG', 'false').lower() == 'true'
     
+    # 模板配置
+    JINJA_BYTECODE_CACHE = os.environ.get('JINJA_BYTECODE_CACHE', 'true').lower() == 'true'  # 模板字节码缓存
+    JINJA_CACHE_DIR = os.environ.get('JINJA_CACHE_DIR')  # 字节码缓存目录，默认 instance/jinja_cache
+    
+    # 性能监控配置（/metrics）
+    SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS') or 500)  # 超过该耗时的请求记录慢请求日志
+    N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD') or 20)  # 同一语句在一个请求中重复执行超过该次数时告警
+    
     # 服务器配置
     BASE_URL = os.environ.get('BASE_URL', 'http://localhost:5000')
     
     # 文件上传配置
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB限制
+    
+    # Excel导入配置
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE') or 500)  # 每批判重和插入的行数
+    IMPORT_PREVIEW_ROWS = int(os.environ.get('IMPORT_PREVIEW_ROWS') or 500)  # 结果页最多展示的行数
+    
+    # 取件码池配置
+    PICKUP_CODE_POOL_REFILL = int(os.environ.get('PICKUP_CODE_POOL_REFILL') or 1000)  # 池为空时每次补充的数量
+    
+    # 批量操作配置
+    BULK_DELETE_CHUNK_SIZE = int(os.environ.get('BULK_DELETE_CHUNK_SIZE') or 500)  # 每批删除并提交的包裹数量
+    BULK_TRANSITION_MAX_ITEMS = int(os.environ.get('BULK_TRANSITION_MAX_ITEMS') or 2000)  # 批量变更状态一次最多处理的包裹数
 
 class DevelopmentConfig(Config):
     """开发环境配置"""
@@ -36,11 +90,15 @@ class DevelopmentConfig(Config):
 class ProductionConfig(Config):
     """生产环境配置"""
     DEBUG = False
+    TEMPLATES_AUTO_RELOAD = False  # 模板只在部署时变化，渲染时不再检查源文件是否修改
+    # gunicorn 每个工作进程默认8个线程，加上发件worker
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 10)
 
 class TestingConfig(Config):
     """测试环境配置"""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    MAIL_QUEUE_WORKERS = 0  # 测试时不启动后台worker，直接调用 process_batch
 
 config = {
     'development': DevelopmentConfig,
@@ -0,0 +1,117 @@
+import logging
+import threading
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from models import db
+
+logger = logging.getLogger(__name__)
+
+
+def _is_memory_sqlite(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def engine_options(config):
+    """按数据库类型生成 SQLALCHEMY_ENGINE_OPTIONS，配置中显式设置的选项优先
+
+    PostgreSQL 等服务器数据库: 连接池大小、取用前 ping、定期回收连接、语句超时；
+    SQLite 文件数据库: 只设置连接池大小（调优参数由 connect 钩子设置）；内存数据库保持默认。
+    """
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    options = {}
+    if _is_memory_sqlite(url):
+        pass
+    elif url.get_backend_name() == 'sqlite':
+        options.update(
+            pool_size=config.get('DB_POOL_SIZE', 5),
+            max_overflow=config.get('DB_MAX_OVERFLOW', 10),
+            pool_timeout=config.get('DB_POOL_TIMEOUT', 10),
+        )
+    else:
+        options.update(
+            pool_size=config.get('DB_POOL_SIZE', 5),
+            max_overflow=config.get('DB_MAX_OVERFLOW', 10),
+            pool_timeout=config.get('DB_POOL_TIMEOUT', 10),
+            pool_recycle=config.get('DB_POOL_RECYCLE', 1800),
+            pool_pre_ping=True,
+        )
+        statement_timeout = config.get('DB_STATEMENT_TIMEOUT', 0)
+        if statement_timeout and url.get_backend_name() == 'postgresql':
+            options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout}'}
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    return options
+
+
+def sqlite_pragmas(config):
+    """SQLite 每个新连接执行的 PRAGMA
+
+    WAL 模式下读写互不阻塞（后台发件线程提交时网页请求仍可读取），synchronous=NORMAL 在 WAL 下
+    只在检查点时 fsync，busy_timeout 让写冲突等待而不是立即报 database is locked。
+    """
+    return [
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        ('busy_timeout', config.get('SQLITE_BUSY_TIMEOUT', 5000)),
+        ('mmap_size', config.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    ]
+
+
+class PoolMonitor:
+    """为数据库引擎注册连接钩子，并统计连接池使用情况"""
+
+    def __init__(self, app=None):
+        self.engine = None
+        self.connects = 0
+        self.checkouts = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        with app.app_context():
+            self.engine = db.engine
+        if self.engine.dialect.name == 'sqlite' and not _is_memory_sqlite(self.engine.url):
+            pragmas = sqlite_pragmas(app.config)
+
+            @event.listens_for(self.engine, 'connect')
+            def _set_sqlite_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for name, value in pragmas:
+                    cursor.execute(f'PRAGMA {name}={value}')
+                cursor.close()
+
+        event.listen(self.engine, 'connect', self._on_connect)
+        event.listen(self.engine, 'checkout', self._on_checkout)
+        event.listen(self.engine, 'invalidate', self._on_invalidate)
+        app.extensions['pool_monitor'] = self
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidations += 1
+        if exception is not None:
+            logger.warning(f"数据库连接已失效并丢弃: {str(exception)}")
+
+    def stats(self):
+        """连接池当前状态和累计计数（本进程）"""
+        pool = self.engine.pool
+        stats = {
+            'dialect': self.engine.dialect.name,
+            'pool_class': type(pool).__name__,
+            'connects': self.connects,
+            'checkouts': self.checkouts,
+            'invalidations': self.invalidations,
+        }
+        for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+            method = getattr(pool, name, None)
+            if callable(method):
+                stats[name] = method()
+        return stats
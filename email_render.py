@@ -0,0 +1,113 @@
+import logging
+import re
+import threading
+from jinja2 import nodes
+from markupsafe import escape
+
+logger = logging.getLogger(__name__)
+
+MARKER_RE = re.compile(r'\x00(\w+)\x00')
+
+
+class _FieldMarker:
+    """渲染骨架时代替包裹对象，每个属性输出一个占位标记"""
+
+    def __getattr__(self, name):
+        return f'\x00{name}\x00'
+
+
+class _Skeleton:
+    """邮件模板的静态HTML骨架：静态片段与包裹字段交替拼接"""
+
+    def __init__(self, rendered):
+        pieces = MARKER_RE.split(rendered)
+        self.static = pieces[0::2]
+        self.fields = pieces[1::2]
+
+    def render(self, package):
+        out = [self.static[0]]
+        for field, static in zip(self.fields, self.static[1:]):
+            out.append(escape(getattr(package, field)))
+            out.append(static)
+        return ''.join(out)
+
+
+def _is_plain_substitution(env, source, var_name):
+    """模板中对 var_name 的引用是否全部是 {{ var.field }} 形式的直接输出
+
+    只有这类模板可以缓存骨架；含条件、过滤器、方法调用或其他变量的模板每次完整渲染。
+    """
+    ast = env.parse(source)
+    names = {node.name for node in ast.find_all(nodes.Name) if node.ctx == 'load'}
+    if names != {var_name}:
+        return False
+    if any(True for _ in ast.find_all((nodes.Extends, nodes.Include, nodes.Import, nodes.FromImport))):
+        return False
+    direct = {
+        id(child)
+        for output in ast.find_all(nodes.Output)
+        for child in output.nodes
+        if isinstance(child, nodes.Getattr) and isinstance(child.node, nodes.Name)
+    }
+    refs = [node for node in ast.find_all(nodes.Getattr)
+            if isinstance(node.node, nodes.Name) and node.node.name == var_name]
+    return bool(refs) and all(id(node) in direct for node in refs)
+
+
+class EmailRenderer:
+    """批量邮件渲染器
+
+    每个模板只从 Jinja 环境加载编译一次；纯字段替换的模板（如深圳到达邮件）还会缓存静态HTML骨架，
+    之后每封邮件只需拼接字符串。渲染不依赖请求上下文，可在发件worker线程中直接调用。
+    """
+
+    def __init__(self, app=None, use_skeleton=None):
+        self.app = None
+        self.use_skeleton = use_skeleton
+        self._templates = {}
+        self._skeletons = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        if self.use_skeleton is None:
+            self.use_skeleton = app.config.get('EMAIL_SKELETON_CACHE', True)
+        app.extensions['email_renderer'] = self
+
+    def _load(self, template_name):
+        """编译模板并（在可能时）生成骨架，结果按模板名缓存"""
+        template = self._templates.get(template_name)
+        if template is not None:
+            return template, self._skeletons.get(template_name)
+
+        with self._lock:
+            env = self.app.jinja_env
+            template = env.get_template(template_name)
+            skeleton = None
+            if self.use_skeleton:
+                source = env.loader.get_source(env, template_name)[0]
+                if _is_plain_substitution(env, source, 'package'):
+                    skeleton = _Skeleton(template.render(package=_FieldMarker()))
+                    logger.info(f"邮件模板骨架已缓存: {template_name} ({len(skeleton.fields)} 个字段)")
+            self._skeletons[template_name] = skeleton
+            self._templates[template_name] = template
+        return template, skeleton
+
+    def render(self, template_name, package, **context):
+        """渲染一封邮件"""
+        template, skeleton = self._load(template_name)
+        if skeleton is not None and not context:
+            return skeleton.render(package)
+        return template.render(package=package, **context)
+
+    def render_many(self, template_name, packages, **context):
+        """批量渲染，返回 (package, html) 迭代器"""
+        for package in packages:
+            yield package, self.render(template_name, package, **context)
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+            self._skeletons.clear()
@@ -0,0 +1,38 @@
+"""
+gunicorn 配置: gunicorn -c gunicorn.conf.py wsgi:app
+
+- 预加载应用（preload_app），fork 前完成初始化和模板编译
+- gthread 工作模式：移动端 SSE 推送长连接各占一个线程，线程数需大于同时在线的移动端数量
+- 平滑重启: kill -HUP <master> 逐个替换工作进程；代码更新用 USR2 启动新主进程后对旧主进程发送 QUIT
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY') or 2)
+threads = int(os.environ.get('GUNICORN_THREADS') or 8)
+worker_class = 'gthread'
+preload_app = True
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT') or 60)
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT') or 30)
+keepalive = 5
+
+# 定期平滑替换工作进程，避免长期运行的内存增长
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS') or 5000)
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info').lower()
+
+
+def post_fork(server, worker):
+    from wsgi import after_fork
+    after_fork()
+
+
+def worker_exit(server, worker):
+    # 停止发件worker并关闭SMTP连接，未发送的任务留在数据库中由其他进程继续处理
+    from wsgi import app
+    app.extensions['mail_queue'].stop(timeout=5)
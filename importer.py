@@ -0,0 +1,164 @@
+import logging
+import time
+from flask import current_app
+from models import db, Package
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_COLUMNS = ['客户名称', '快递单号', '客户邮箱', '备注']
+
+
+def _cell_text(value):
+    """单元格值转为去空白的字符串"""
+    return str(value).strip() if value is not None else ''
+
+
+def _iter_chunks(iterable, size):
+    """按固定大小切分迭代器"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _insert_chunk(chunk, seen, result, preview_limit):
+    """处理一批数据行：一次查询判重，一次批量插入，一次回查ID"""
+    tracking_numbers = [row['tracking_number'] for row in chunk]
+    existing = {
+        number for (number,) in db.session.query(Package.shenzhen_tracking_number)
+        .filter(Package.shenzhen_tracking_number.in_(tracking_numbers))
+    }
+
+    new_rows = []
+    for row in chunk:
+        number = row['tracking_number']
+        if number in existing or number in seen:
+            result['skipped_count'] += 1
+            if len(result['skipped_rows']) < preview_limit:
+                result['skipped_rows'].append(dict(row, reason='快递单号已存在'))
+            continue
+        seen.add(number)
+        new_rows.append(row)
+
+    if not new_rows:
+        return
+
+    pickup_codes = Package.generate_pickup_codes(len(new_rows))
+    db.session.execute(Package.__table__.insert(), [
+        {
+            'customer_name': row['customer_name'],
+            'shenzhen_tracking_number': row['tracking_number'],
+            'customer_email': row['email'],
+            'notes': row['notes'],
+            'pickup_code': code,
+        }
+        for row, code in zip(new_rows, pickup_codes)
+    ])
+
+    new_numbers = [row['tracking_number'] for row in new_rows]
+    id_map = dict(
+        db.session.query(Package.shenzhen_tracking_number, Package.id)
+        .filter(Package.shenzhen_tracking_number.in_(new_numbers))
+    )
+    for row in new_rows:
+        result['ids'].append(id_map[row['tracking_number']])
+        if len(result['rows']) < preview_limit:
+            result['rows'].append(row)
+    result['count'] += len(new_rows)
+
+
+def import_packages_from_sheet(ws):
+    """从工作表流式导入包裹，返回导入结果字典"""
+    chunk_size = current_app.config.get('IMPORT_CHUNK_SIZE', 500)
+    preview_limit = current_app.config.get('IMPORT_PREVIEW_ROWS', 500)
+
+    rows_iter = ws.iter_rows(values_only=True)
+    header_row = next(rows_iter, None) or ()
+    headers = [_cell_text(value) for value in header_row]
+
+    missing_cols = [col for col in REQUIRED_COLUMNS if col not in headers]
+    if missing_cols:
+        return {'success': False, 'error': f'Excel缺少必要列: {", ".join(missing_cols)}，请使用模板'}
+
+    # 获取列索引
+    customer_name_idx = headers.index('客户名称')
+    tracking_number_idx = headers.index('快递单号')
+    email_idx = headers.index('客户邮箱')
+    notes_idx = headers.index('备注')
+    width = max(customer_name_idx, tracking_number_idx, email_idx, notes_idx) + 1
+
+    def parsed_rows():
+        for values in rows_iter:
+            if len(values) < width:
+                values = tuple(values) + (None,) * (width - len(values))
+            row = {
+                'customer_name': _cell_text(values[customer_name_idx]),
+                'tracking_number': _cell_text(values[tracking_number_idx]),
+                'email': _cell_text(values[email_idx]),
+                'notes': _cell_text(values[notes_idx]),
+            }
+            if row['customer_name'] and row['tracking_number'] and row['email']:
+                yield row
+
+    result = {
+        'success': True,
+        'count': 0,
+        'rows': [],
+        'ids': [],
+        'skipped_count': 0,
+        'skipped_rows': [],
+    }
+    seen = set()
+    started = time.perf_counter()
+    for chunk in _iter_chunks(parsed_rows(), chunk_size):
+        _insert_chunk(chunk, seen, result, preview_limit)
+    db.session.commit()
+
+    elapsed = time.perf_counter() - started
+    processed = result['count'] + result['skipped_count']
+    result['elapsed'] = round(elapsed, 3)
+    result['rows_per_second'] = int(processed / elapsed) if elapsed > 0 else processed
+    logger.info(f"Excel导入完成: 导入 {result['count']} 条, 跳过 {result['skipped_count']} 条, "
+                f"用时 {elapsed:.2f}s ({result['rows_per_second']} 行/秒)")
+    return result
+
+
+def import_excel_file(file):
+    """校验上传的Excel文件并导入，返回导入结果字典"""
+    if not file:
+        return {'success': False, 'error': '请选择要上传的文件'}
+    if not file.filename:
+        return {'success': False, 'error': '文件名不能为空'}
+    if not file.filename.endswith('.xlsx'):
+        return {'success': False, 'error': '请上传xlsx格式的Excel文件'}
+
+    try:
+        # 检查文件是否为空
+        file.seek(0, 2)  # 移动到文件末尾
+        file_size = file.tell()
+        file.seek(0)  # 重置到文件开头
+
+        if file_size == 0:
+            return {'success': False, 'error': '上传的文件为空'}
+        if file_size > current_app.config.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024):
+            return {'success': False, 'error': '文件大小超过限制（最大16MB）'}
+
+        # 只读模式流式读取，内存占用与行数无关
+        from openpyxl import load_workbook
+        wb = load_workbook(file, read_only=True, data_only=True)
+        try:
+            return import_packages_from_sheet(wb.active)
+        finally:
+            wb.close()
+    except Exception as e:
+        db.session.rollback()
+        error_msg = str(e)
+        if "File is not a zip file" in error_msg:
+            return {'success': False, 'error': '文件格式错误：请确保上传的是有效的Excel文件(.xlsx)，不是其他格式的文件'}
+        if "No sheet names" in error_msg:
+            return {'success': False, 'error': 'Excel文件没有工作表，请检查文件内容'}
+        return {'success': False, 'error': f'导入失败: {error_msg}'}
@@ -15,19 +15,19 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 def init_database():
     """初始化数据库"""
     try:
-        from app import create_app
-        from models import db, Package
+        from app import create_app, init_database as create_tables
+        from models import Package
         
         print("🚀 初始化Render数据库...")
         
         # 创建应用
         app = create_app()
         
+        # 创建所有表
+        create_tables(app)
+        print("✅ 数据库表创建成功")
+        
         with app.app_context():
-            # 创建所有表
-            db.create_all()
-            print("✅ 数据库表创建成功")
-            
             # 检查是否有数据
             package_count = Package.query.count()
             print(f"📊 当前包裹数量: {package_count}")
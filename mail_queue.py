@@ -0,0 +1,265 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from models import db, Package, EmailJob
+from smtp_pool import SMTPConnectionPool
+from utils import send_shenzhen_arrival_email, send_cafe_arrival_email
+
+logger = logging.getLogger(__name__)
+
+SENDERS = {
+    'shenzhen': send_shenzhen_arrival_email,
+    'cafe': send_cafe_arrival_email,
+}
+EMAIL_SENT_FLAGS = {
+    'shenzhen': Package.shenzhen_email_sent,
+    'cafe': Package.cafe_email_sent,
+}
+QUERY_CHUNK_SIZE = 500  # IN 查询每批的参数个数，兼容SQLite参数上限
+
+
+def enqueue_emails(package_ids, email_type, force=False):
+    """把邮件任务加入发送队列，返回入队的任务数
+
+    在调用方的事务中执行，与包裹状态变更一起提交（提交后调用 notify_workers 唤醒worker）。
+    同一包裹同一种邮件只有一个任务：排队中的任务不会重复入队，已发送的任务只有 force=True
+    （手动重发）时才会重新排队。
+    """
+    if email_type not in SENDERS:
+        raise ValueError(f'未知的邮件类型: {email_type}')
+
+    package_ids = list(dict.fromkeys(package_ids))
+    now = datetime.utcnow()
+    resettable = ('sent', 'failed') if force else ('failed',)
+    queued = 0
+
+    for i in range(0, len(package_ids), QUERY_CHUNK_SIZE):
+        chunk = [package_id for (package_id,) in db.session.query(Package.id)
+                 .filter(Package.id.in_(package_ids[i:i + QUERY_CHUNK_SIZE]))]
+        existing = dict(
+            db.session.query(EmailJob.package_id, EmailJob.status)
+            .filter(EmailJob.email_type == email_type, EmailJob.package_id.in_(chunk))
+        )
+
+        new_ids = [package_id for package_id in chunk if package_id not in existing]
+        if new_ids:
+            db.session.execute(EmailJob.__table__.insert(), [
+                {'package_id': package_id, 'email_type': email_type, 'status': 'pending',
+                 'attempts': 0, 'next_attempt_at': now}
+                for package_id in new_ids
+            ])
+
+        reset_ids = [package_id for package_id, status in existing.items() if status in resettable]
+        if reset_ids:
+            db.session.execute(
+                db.update(EmailJob)
+                .where(EmailJob.email_type == email_type, EmailJob.package_id.in_(reset_ids))
+                .values(status='pending', attempts=0, next_attempt_at=now, locked_at=None, last_error=None)
+                .execution_options(synchronize_session=False)
+            )
+
+        queued += len(new_ids) + len(reset_ids)
+
+    return queued
+
+
+def mark_emails_sent(package_ids, email_type):
+    """批量更新邮件发送状态：每批一条 UPDATE ... WHERE id IN (...)，由调用方提交"""
+    flag = EMAIL_SENT_FLAGS[email_type]
+    now = datetime.utcnow()
+    for i in range(0, len(package_ids), QUERY_CHUNK_SIZE):
+        db.session.execute(
+            db.update(Package)
+            .where(Package.id.in_(package_ids[i:i + QUERY_CHUNK_SIZE]))
+            .values({flag: True, Package.updated_at: now})
+            .execution_options(synchronize_session=False)
+        )
+
+
+def notify_workers():
+    """唤醒发件worker，立即处理新入队的任务"""
+    queue = current_app.extensions.get('mail_queue')
+    if queue is not None:
+        queue.ensure_started()
+        queue.wake()
+
+
+class MailQueue:
+    """基于数据库任务表的后台发件队列"""
+
+    def __init__(self, app=None, mail=None):
+        self.app = None
+        self.mail = None
+        self.pool = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+        if app is not None:
+            self.init_app(app, mail)
+
+    def init_app(self, app, mail):
+        self.app = app
+        self.mail = mail
+        self.pool = SMTPConnectionPool(mail)
+        app.extensions['mail_queue'] = self
+
+    def ensure_started(self):
+        """在当前进程中启动worker（fork之后的子进程会重新启动自己的worker）"""
+        workers = self.app.config.get('MAIL_QUEUE_WORKERS', 0)
+        if workers <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._stopping.clear()
+            self._threads = []
+            for i in range(workers):
+                thread = threading.Thread(target=self._run, name=f'mail-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._pid = os.getpid()
+            logger.info(f"发件队列已启动 {workers} 个worker (pid={self._pid})")
+
+    def stop(self, timeout=None):
+        """停止worker，未处理的任务保留在数据库中"""
+        with self._lock:
+            self._stopping.set()
+            self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self.pool.close_all()
+        self._threads = []
+        self._pid = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    def stats(self):
+        """队列与SMTP连接池的统计信息"""
+        counts = dict(db.session.query(EmailJob.status, db.func.count(EmailJob.id))
+                      .group_by(EmailJob.status))
+        return {
+            'workers': len(self._threads),
+            'jobs': counts,
+            'smtp': self.pool.stats(),
+        }
+
+    def _run(self):
+        poll_interval = self.app.config.get('MAIL_QUEUE_POLL_INTERVAL', 5)
+        try:
+            while not self._stopping.is_set():
+                processed = 0
+                with self.app.app_context():
+                    try:
+                        processed = self.process_batch()
+                    except Exception as e:
+                        db.session.rollback()
+                        logger.error(f"发件队列处理异常: {e}")
+                    finally:
+                        db.session.remove()
+                if not processed:
+                    # 队列已清空，释放本线程的SMTP会话
+                    self.pool.close()
+                    self._wakeup.wait(poll_interval)
+                    # 与 stop() 互斥：停止后唤醒信号保持置位，其他worker不会因此错过
+                    with self._lock:
+                        if not self._stopping.is_set():
+                            self._wakeup.clear()
+        finally:
+            # worker退出时关闭本线程的SMTP会话
+            self.pool.close()
+
+    def _claim_jobs(self, limit):
+        """领取一批到期任务并标记为发送中，多个worker并发时互不重复"""
+        now = datetime.utcnow()
+        lease_expired = now - timedelta(seconds=self.app.config.get('MAIL_QUEUE_LEASE', 300))
+        due = db.or_(
+            db.and_(EmailJob.status == 'pending', EmailJob.next_attempt_at <= now),
+            db.and_(EmailJob.status == 'sending', EmailJob.locked_at < lease_expired),
+        )
+        ids = db.session.query(EmailJob.id).filter(due).order_by(EmailJob.next_attempt_at) \
+            .limit(limit).with_for_update(skip_locked=True).scalar_subquery()
+        result = db.session.execute(
+            db.update(EmailJob)
+            .where(EmailJob.id.in_(ids), due)
+            .values(status='sending', locked_at=now)
+            .returning(EmailJob.id, EmailJob.package_id, EmailJob.email_type, EmailJob.attempts)
+            .execution_options(synchronize_session=False)
+        )
+        jobs = result.all()
+        db.session.commit()
+        return jobs
+
+    def _record_results(self, results):
+        """把一批发送结果写入台账：成功的按类型合并为一条 UPDATE，失败的按指数退避重新排队"""
+        now = datetime.utcnow()
+        max_attempts = self.app.config.get('MAIL_MAX_ATTEMPTS', 5)
+        sent = {}
+        for job_id, package_id, email_type, attempts, success, error in results:
+            if success:
+                sent.setdefault(email_type, []).append((job_id, package_id))
+                continue
+            values = {'attempts': attempts, 'locked_at': None, 'last_error': error}
+            if attempts >= max_attempts:
+                values['status'] = 'failed'
+            else:
+                backoff = self.app.config.get('MAIL_RETRY_BACKOFF', 30) * 2 ** (attempts - 1)
+                values.update(status='pending', next_attempt_at=now + timedelta(seconds=min(backoff, 3600)))
+            db.session.execute(
+                db.update(EmailJob).where(EmailJob.id == job_id).values(**values)
+                .execution_options(synchronize_session=False)
+            )
+
+        for email_type, items in sent.items():
+            mark_emails_sent([package_id for _, package_id in items], email_type)
+            db.session.execute(
+                db.update(EmailJob)
+                .where(EmailJob.id.in_([job_id for job_id, _ in items]))
+                .values(status='sent', attempts=EmailJob.attempts + 1, locked_at=None, last_error=None)
+                .execution_options(synchronize_session=False)
+            )
+        db.session.commit()
+
+    def process_batch(self):
+        """处理一批到期任务，返回处理数量"""
+        jobs = self._claim_jobs(self.app.config.get('MAIL_QUEUE_BATCH_SIZE', 20))
+        if not jobs:
+            return 0
+
+        packages = {
+            package.id: package
+            for package in Package.query.filter(Package.id.in_({job[1] for job in jobs}))
+        }
+        results = []  # 发送结果台账，整批一次写回
+        metrics = self.app.extensions.get('metrics')
+        try:
+            for job_id, package_id, email_type, attempts in jobs:
+                attempts += 1
+                package = packages.get(package_id)
+                if package is None:
+                    results.append((job_id, package_id, email_type,
+                                    self.app.config.get('MAIL_MAX_ATTEMPTS', 5), False, '包裹不存在'))
+                    continue
+                started = time.perf_counter()
+                try:
+                    success = SENDERS[email_type](package, self.pool)
+                    error = None if success else '邮件发送失败，详见日志'
+                except Exception as e:
+                    success, error = False, str(e)
+                if metrics is not None:
+                    metrics.observe_email(email_type, time.perf_counter() - started, success)
+                results.append((job_id, package_id, email_type, attempts, success, error))
+                if not success:
+                    logger.warning(f"邮件任务失败(第{attempts}次): {email_type} -> {package.customer_email}: {error}")
+        finally:
+            # 即使中途出错，已发送的结果也要记录，避免重复发送
+            self._record_results(results)
+
+        sent_count = sum(1 for result in results if result[4])
+        logger.info(f"发件批次完成: 成功 {sent_count} 封, 失败 {len(results) - sent_count} 封")
+        return len(jobs)
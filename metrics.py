@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+from collections import Counter
+from flask import g, has_request_context, request, template_rendered, before_render_template
+from sqlalchemy import event
+from models import db
+
+logger = logging.getLogger(__name__)
+
+# 耗时直方图的桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 每个请求SQL语句数的桶
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    """按标签分组的累积直方图（Prometheus 格式）"""
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}  # labels -> [每个桶的计数..., 总和, 次数]
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, series in sorted(self._series.items()):
+            label_text = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            prefix = label_text + ',' if label_text else ''
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-1]}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {series[-2]:.6f}')
+            lines.append(f'{self.name}_count{{{label_text}}} {series[-1]}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _counter_lines(name, help_text, label_names, values):
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+    for labels, value in sorted(values.items()):
+        label_text = ','.join(f'{label}="{_escape(v)}"' for label, v in zip(label_names, labels))
+        lines.append(f'{name}{{{label_text}}} {value}')
+    return lines
+
+
+class Metrics:
+    """请求级性能统计: 各路由耗时、SQL语句数和耗时、模板渲染耗时、邮件发送耗时
+
+    SQL 通过引擎事件计时，模板通过 Flask 渲染信号计时。请求超过 SLOW_REQUEST_MS，或同一条语句
+    在一个请求中重复执行超过 N_PLUS_ONE_THRESHOLD 次（典型的 N+1 查询）时记录警告日志。
+    统计保存在本进程内，/metrics 以 Prometheus 文本格式输出（多worker部署时每次抓取到其中一个进程）。
+    """
+
+    def __init__(self, app=None):
+        self.slow_request = 0.5
+        self.repeat_threshold = 20
+        self._lock = threading.Lock()
+        self.request_latency = Histogram('http_request_duration_seconds', '请求处理耗时',
+                                         ('endpoint', 'method'), LATENCY_BUCKETS)
+        self.request_queries = Histogram('http_request_sql_statements', '每个请求执行的SQL语句数',
+                                         ('endpoint',), QUERY_COUNT_BUCKETS)
+        self.request_sql_time = Histogram('http_request_sql_duration_seconds', '每个请求SQL语句总耗时',
+                                          ('endpoint',), LATENCY_BUCKETS)
+        self.template_latency = Histogram('template_render_duration_seconds', '模板渲染耗时',
+                                          ('template',), LATENCY_BUCKETS)
+        self.email_latency = Histogram('email_send_duration_seconds', '单封邮件渲染和发送耗时',
+                                       ('email_type', 'result'), LATENCY_BUCKETS)
+        self.responses = Counter()  # (endpoint, status) -> 次数
+        self.sql_statements = 0  # 包括后台线程在内的全部SQL语句数
+        self.slow_requests = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.slow_request = app.config.get('SLOW_REQUEST_MS', 500) / 1000
+        self.repeat_threshold = app.config.get('N_PLUS_ONE_THRESHOLD', 20)
+        app.extensions['metrics'] = self
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._before_execute)
+            event.listen(db.engine, 'after_cursor_execute', self._after_execute)
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.sql_count = 0
+        g.sql_time = 0.0
+        g.sql_statements = Counter()
+        g.template_time = 0.0
+
+    def _after_request(self, response):
+        started = g.get('metrics_started')
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unknown'
+        with self._lock:
+            self.request_latency.observe((endpoint, request.method), elapsed)
+            self.request_queries.observe((endpoint,), g.sql_count)
+            self.request_sql_time.observe((endpoint,), g.sql_time)
+            self.responses[(endpoint, str(response.status_code))] += 1
+
+        if elapsed > self.slow_request:
+            with self._lock:
+                self.slow_requests += 1
+            logger.warning(f"慢请求: {request.method} {request.full_path.rstrip('?')} {elapsed * 1000:.0f}ms，"
+                           f"SQL {g.sql_count} 条 {g.sql_time * 1000:.0f}ms，模板 {g.template_time * 1000:.0f}ms")
+        if g.sql_statements:
+            statement, count = g.sql_statements.most_common(1)[0]
+            if count > self.repeat_threshold:
+                logger.warning(f"疑似N+1查询: {endpoint} 中同一语句执行了 {count} 次: {' '.join(statement.split())[:200]}")
+        return response
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info['metrics_started'] = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info.pop('metrics_started', time.perf_counter())
+        with self._lock:
+            self.sql_statements += 1
+        if has_request_context() and 'sql_statements' in g:
+            g.sql_count += 1
+            g.sql_time += elapsed
+            g.sql_statements[statement] += 1
+
+    def _before_render(self, sender, template, context, **extra):
+        if has_request_context():
+            g.setdefault('template_started', []).append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra):
+        if not has_request_context() or not g.get('template_started'):
+            return
+        elapsed = time.perf_counter() - g.template_started.pop()
+        if not g.template_started:
+            g.template_time = g.get('template_time', 0.0) + elapsed  # 嵌套调用 render_template 时只计最外层
+        with self._lock:
+            self.template_latency.observe((template.name or 'string',), elapsed)
+
+    def observe_email(self, email_type, seconds, success):
+        with self._lock:
+            self.email_latency.observe((email_type, 'sent' if success else 'failed'), seconds)
+
+    def render(self, extra_gauges=None):
+        """Prometheus 文本格式"""
+        with self._lock:
+            lines = []
+            for histogram in (self.request_latency, self.request_queries, self.request_sql_time,
+                              self.template_latency, self.email_latency):
+                lines.extend(histogram.render())
+            lines.extend(_counter_lines('http_responses_total', '按状态码统计的响应数',
+                                        ('endpoint', 'status'), self.responses))
+            lines.extend(['# HELP sql_statements_total 执行的SQL语句总数（含后台线程）',
+                          '# TYPE sql_statements_total counter',
+                          f'sql_statements_total {self.sql_statements}',
+                          '# HELP http_slow_requests_total 超过慢请求阈值的请求数',
+                          '# TYPE http_slow_requests_total counter',
+                          f'http_slow_requests_total {self.slow_requests}'])
+        for name, (help_text, value) in sorted((extra_gauges or {}).items()):
+            lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}'])
+        return '\n'.join(lines) + '\n'
@@ -1,64 +1,53 @@
 #!/usr/bin/env python3
 """
-数据库迁移脚本：为现有包裹添加二维码字段
+数据库迁移脚本：为现有包裹批量生成二维码
+按 id 分块生成并逐块提交，中断后重新运行会从未完成的包裹继续；
+取件码变化后二维码已过期的包裹也会重新生成。
+用法: python migrate_add_qr_code.py [--chunk-size 500] [--workers N]
 """
 
+import argparse
 import os
 import sys
-from datetime import datetime
 
 # 添加项目根目录到Python路径
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from app import create_app
-from models import db, Package
+from models import db
+from package_qr import backfill_package_qrs
 
-def migrate_add_qr_code():
-    """为现有包裹添加二维码字段"""
+
+def print_progress(done, total, elapsed):
+    rate = done / elapsed if elapsed > 0 else 0
+    print(f"进度: {done}/{total} ({done * 100 / total:.1f}%)，{rate:.0f} 个/秒")
+
+
+def migrate_add_qr_code(chunk_size=500, workers=None):
+    """为缺少二维码的包裹生成二维码"""
     app = create_app()
-    
+
     with app.app_context():
-        print("开始数据库迁移：添加二维码字段...")
-        
-        # 获取所有没有二维码的包裹
-        packages_without_qr = Package.query.filter_by(qr_code_image=None).all()
-        
-        if not packages_without_qr:
-            print("所有包裹都已经有二维码了！")
-            return
-        
-        print(f"找到 {len(packages_without_qr)} 个包裹需要生成二维码...")
-        
-        success_count = 0
-        error_count = 0
-        
-        for package in packages_without_qr:
-            try:
-                # 生成二维码
-                qr_code_image = Package.generate_qr_code(package.pickup_code, app.config.get('BASE_URL'))
-                
-                if qr_code_image:
-                    package.qr_code_image = qr_code_image
-                    package.updated_at = datetime.utcnow()
-                    success_count += 1
-                    print(f"✅ 成功为包裹 {package.id} ({package.customer_name}) 生成二维码")
-                else:
-                    error_count += 1
-                    print(f"❌ 包裹 {package.id} ({package.customer_name}) 二维码生成失败")
-                    
-            except Exception as e:
-                error_count += 1
-                print(f"❌ 包裹 {package.id} ({package.customer_name}) 处理失败: {str(e)}")
-        
-        # 提交更改
+        print("开始数据库迁移：生成包裹二维码...")
+        db.create_all()  # 创建 package_qr 表
+
         try:
-            db.session.commit()
-            print(f"\n迁移完成！")
-            print(f"成功: {success_count} 个包裹")
-            print(f"失败: {error_count} 个包裹")
+            count = backfill_package_qrs(chunk_size=chunk_size, workers=workers, progress=print_progress)
         except Exception as e:
             db.session.rollback()
-            print(f"❌ 提交更改失败: {str(e)}")
+            print(f"❌ 生成二维码失败: {str(e)}")
+            print("已完成的部分已保存，重新运行脚本即可继续。")
+            return
+
+        if count == 0:
+            print("所有包裹都已经有二维码了！")
+        else:
+            print(f"\n迁移完成！共生成 {count} 个二维码")
+
 
 if __name__ == '__main__':
-    migrate_add_qr_code() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='为现有包裹批量生成二维码')
+    parser.add_argument('--chunk-size', type=int, default=500, help='每批处理的包裹数量')
+    parser.add_argument('--workers', type=int, default=None, help='并行生成的进程数，默认等于CPU核数')
+    args = parser.parse_args()
+    migrate_add_qr_code(chunk_size=args.chunk_size, workers=args.workers)
@@ -1,10 +1,51 @@
+import logging
+from flask import current_app, has_app_context
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timedelta
-import random
-import string
+from sqlalchemy import event, inspect
 import pytz
 
 db = SQLAlchemy()
+logger = logging.getLogger(__name__)
+
+PICKUP_HOLD_DAYS = 7  # 到达咖啡馆后的默认保留天数，可通过 PICKUP_HOLD_DAYS 配置修改
+PARIS_TZ = pytz.timezone('Europe/Paris')  # 只加载一次时区数据
+STATUS_DISPLAY = {
+    'shenzhen_arrived': '已到深圳',
+    'cafe_arrived': '已到咖啡馆',
+    'picked_up': '已取件'
+}
+STATUS_COLOR = {
+    'shenzhen_arrived': 'warning',
+    'cafe_arrived': 'success',
+    'picked_up': 'primary'
+}
+
+
+def to_paris(dt):
+    """转换为巴黎时间（不带时区的时间按UTC处理）"""
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        return PARIS_TZ.fromutc(dt.replace(tzinfo=PARIS_TZ))
+    return dt.astimezone(PARIS_TZ)
+
+
+def pickup_hold():
+    """取件保留期"""
+    days = current_app.config.get('PICKUP_HOLD_DAYS', PICKUP_HOLD_DAYS) if has_app_context() else PICKUP_HOLD_DAYS
+    return timedelta(days=days)
+
+
+def ensure_indexes():
+    """为已存在的表补建索引（create_all 只会创建缺失的表，不会给旧表加索引），并删除已被取代的索引"""
+    with db.engine.begin() as conn:
+        for name in OBSOLETE_INDEXES:
+            conn.execute(db.text(f'DROP INDEX IF EXISTS {name}'))
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
 
 class Package(db.Model):
     """集运包裹模型"""
@@ -16,12 +57,25 @@ class Package(db.Model):
     shenzhen_arrival_date = db.Column(db.DateTime, default=datetime.utcnow)
     cafe_arrival_date = db.Column(db.DateTime)
     pickup_date = db.Column(db.DateTime)  # 新增：取件时间
-    status = db.Column(db.String(20), default='shenzhen_arrived')
+    # active_history: 对已过期的实例赋值时也加载旧状态，变更事件和统计依赖 history.deleted
+    status = db.column_property(db.Column(db.String(20), default='shenzhen_arrived'), active_history=True)
     shenzhen_email_sent = db.Column(db.Boolean, default=False)
     cafe_email_sent = db.Column(db.Boolean, default=False)
     notes = db.Column(db.Text)  # 新增：备注字段
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    pickup_deadline = db.Column(db.DateTime)  # 最晚取件时间，设置咖啡馆到达时间时写入
+
+    __table_args__ = (
+        # /api/packages?updated_since= 增量同步
+        db.Index('ix_package_updated_at', 'updated_at'),
+        # /api/pickup_codes 的数据版本: max(updated_at) WHERE status = ...
+        db.Index('ix_package_status_updated_at', 'status', 'updated_at'),
+        # 当前货架: 最近取走的包裹
+        db.Index('ix_package_status_pickup_date', 'status', 'pickup_date'),
+        # 逾期查询: status = 'cafe_arrived' AND pickup_deadline < now
+        db.Index('ix_package_status_pickup_deadline', 'status', 'pickup_deadline'),
+    )
 
     def __repr__(self):
         return f'<Package {self.id}: {self.customer_name} - {self.shenzhen_tracking_number}>'
@@ -29,26 +83,13 @@ class Package(db.Model):
     @staticmethod
     def generate_pickup_code():
         """生成唯一的取件码"""
-        max_attempts = 100  # 防止无限循环
-        attempts = 0
-        
-        while attempts < max_attempts:
-            # 生成6位数字取件码
-            pickup_code = ''.join(random.choices(string.digits, k=6))
-            
-            try:
-                # 检查是否已存在
-                if not Package.query.filter_by(pickup_code=pickup_code).first():
-                    return pickup_code
-            except Exception as e:
-                # 如果查询失败，记录错误并继续尝试
-                import logging
-                logging.error(f"检查取件码唯一性时出错: {e}")
-            
-            attempts += 1
-        
-        # 如果尝试次数过多，抛出异常
-        raise ValueError("无法生成唯一的取件码，请重试") 
+        return Package.generate_pickup_codes(1)[0]
+
+    @staticmethod
+    def generate_pickup_codes(count):
+        """批量生成唯一的取件码（从预分配的取件码池中取出）"""
+        from pickup_codes import allocate_pickup_codes
+        return allocate_pickup_codes(count)
 
     def to_dict(self):
         """转换为字典格式"""
@@ -72,28 +113,20 @@ class Package(db.Model):
     @property
     def status_display(self):
         """状态显示文本"""
-        status_map = {
-            'shenzhen_arrived': '已到深圳',
-            'cafe_arrived': '已到咖啡馆',
-            'picked_up': '已取件'
-        }
-        return status_map.get(self.status, self.status)
+        return STATUS_DISPLAY.get(self.status, self.status)
 
     @property
     def status_color(self):
         """状态对应的颜色"""
-        color_map = {
-            'shenzhen_arrived': 'warning',
-            'cafe_arrived': 'success',
-            'picked_up': 'primary'
-        }
-        return color_map.get(self.status, 'secondary')
+        return STATUS_COLOR.get(self.status, 'secondary')
     
     @property
     def latest_pickup_time(self):
-        """计算最晚取货时间（从咖啡馆到达后7天）"""
+        """最晚取货时间（咖啡馆到达时间 + 保留期，到达时写入 pickup_deadline）"""
+        if self.pickup_deadline:
+            return self.pickup_deadline
         if self.cafe_arrival_date:
-            return self.cafe_arrival_date + timedelta(days=7)
+            return self.cafe_arrival_date + pickup_hold()
         return None
     
     @property
@@ -105,13 +138,7 @@ class Package(db.Model):
     
     def to_paris_time(self, dt):
         """转换为巴黎时间"""
-        if dt is None:
-            return None
-        utc_tz = pytz.UTC
-        paris_tz = pytz.timezone('Europe/Paris')
-        if dt.tzinfo is None:
-            dt = utc_tz.localize(dt)
-        return dt.astimezone(paris_tz)
+        return to_paris(dt)
     
     @property
     def cafe_arrival_date_paris(self):
@@ -126,4 +153,171 @@ class Package(db.Model):
     @property
     def pickup_date_paris(self):
         """取件时间（巴黎时间）"""
-        return self.to_paris_time(self.pickup_date) 
\ No newline at end of file
+        return self.to_paris_time(self.pickup_date)
+
+
+# 首页键集分页：按 (cafe_arrival_date DESC NULLS LAST, id DESC) 排序，可带状态筛选。
+# 索引方向与 ORDER BY 一致；SQLite 的索引不支持声明 NULLS LAST（DESC 时空值本来就排在最后）
+db.Index('ix_package_status_cafe_arrival_desc', Package.status,
+         Package.cafe_arrival_date.desc().nullslast(), Package.id.desc()).ddl_if(dialect='postgresql')
+db.Index('ix_package_status_cafe_arrival_desc', Package.status,
+         Package.cafe_arrival_date.desc(), Package.id.desc()).ddl_if(dialect='sqlite')
+db.Index('ix_package_cafe_arrival_desc',
+         Package.cafe_arrival_date.desc().nullslast(), Package.id.desc()).ddl_if(dialect='postgresql')
+db.Index('ix_package_cafe_arrival_desc',
+         Package.cafe_arrival_date.desc(), Package.id.desc()).ddl_if(dialect='sqlite')
+
+# 已被上面的降序索引取代
+OBSOLETE_INDEXES = ('ix_package_status_cafe_arrival_id', 'ix_package_cafe_arrival_id')
+
+
+@event.listens_for(Package.cafe_arrival_date, 'set')
+def _set_pickup_deadline(target, value, oldvalue, initiator):
+    """设置咖啡馆到达时间时同步写入最晚取件时间"""
+    target.pickup_deadline = value + pickup_hold() if value else None
+
+
+# 在已有表上后来新增的列，create_all 不会自动补加
+ADDED_COLUMNS = [Package.__table__.c.pickup_deadline]
+
+
+def ensure_columns():
+    """为已存在的表补加新列，补加 pickup_deadline 后回填历史数据"""
+    inspector = inspect(db.engine)
+    for column in ADDED_COLUMNS:
+        table = column.table
+        if not inspector.has_table(table.name):
+            continue
+        if column.name in {c['name'] for c in inspector.get_columns(table.name)}:
+            continue
+        column_type = column.type.compile(dialect=db.engine.dialect)
+        with db.engine.begin() as conn:
+            conn.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+        logger.info(f"已添加列 {table.name}.{column.name}")
+        if column is Package.__table__.c.pickup_deadline:
+            backfill_pickup_deadlines()
+
+
+def backfill_pickup_deadlines(chunk_size=1000):
+    """按当前保留期为缺少最晚取件时间的包裹回填，按 id 分块提交"""
+    table = Package.__table__
+    stmt = table.update().where(table.c.id == db.bindparam('b_id')) \
+        .values(pickup_deadline=db.bindparam('b_deadline'))
+    hold = pickup_hold()
+    total = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(Package.id, Package.cafe_arrival_date).filter(
+            Package.id > last_id,
+            Package.pickup_deadline.is_(None),
+            Package.cafe_arrival_date.isnot(None)
+        ).order_by(Package.id).limit(chunk_size).all()
+        if not rows:
+            break
+        db.session.execute(stmt, [{'b_id': package_id, 'b_deadline': arrival + hold} for package_id, arrival in rows])
+        db.session.commit()
+        total += len(rows)
+        last_id = rows[-1][0]
+    if total:
+        logger.info(f"已回填 {total} 个包裹的最晚取件时间")
+    return total
+
+
+class PickupCodePool(db.Model):
+    """预生成的取件码池，记录每个取件码是否已被占用"""
+    __tablename__ = 'pickup_code_pool'
+    id = db.Column(db.Integer, primary_key=True)  # 按插入顺序分配，取件码本身随机
+    code = db.Column(db.String(10), unique=True, nullable=False)
+    in_use = db.Column(db.Boolean, default=False, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_pickup_code_pool_in_use_id', 'in_use', 'id'),
+    )
+
+    def __repr__(self):
+        return f'<PickupCodePool {self.code}>'
+
+
+class EmailJob(db.Model):
+    """待发送邮件任务（持久化的发件队列）"""
+    __tablename__ = 'email_job'
+    id = db.Column(db.Integer, primary_key=True)
+    package_id = db.Column(db.Integer, nullable=False)
+    email_type = db.Column(db.String(20), nullable=False)  # shenzhen / cafe
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending / sending / sent / failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    locked_at = db.Column(db.DateTime)  # 被worker领取的时间，用于回收崩溃worker的任务
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # 幂等：同一个包裹同一种邮件只保留一个任务
+        db.UniqueConstraint('package_id', 'email_type', name='uq_email_job_package_type'),
+        db.Index('ix_email_job_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+    def __repr__(self):
+        return f'<EmailJob {self.id}: {self.email_type} package={self.package_id} {self.status}>'
+
+
+class PackageQR(db.Model):
+    """包裹二维码（PNG字节），首次请求时生成，批量回填见 migrate_add_qr_code.py"""
+    __tablename__ = 'package_qr'
+    package_id = db.Column(db.Integer, primary_key=True)
+    content = db.Column(db.String(255), nullable=False)  # 二维码编码的内容，取件码变化时据此重新生成
+    png = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<PackageQR {self.package_id}: {len(self.png)} bytes>'
+
+
+class DailyStat(db.Model):
+    """按天汇总的业务计数，在状态变更时增量更新"""
+    __tablename__ = 'daily_stat'
+    day = db.Column(db.Date, primary_key=True)  # UTC日期
+    arrivals = db.Column(db.Integer, default=0, nullable=False)  # 到达咖啡馆
+    pickups = db.Column(db.Integer, default=0, nullable=False)  # 取件
+    overdue = db.Column(db.Integer, default=0, nullable=False)  # 超过最晚取件时间才取件
+
+    def to_dict(self):
+        return {
+            'date': self.day.isoformat(),
+            'arrivals': self.arrivals,
+            'pickups': self.pickups,
+            'overdue': self.overdue
+        }
+
+    def __repr__(self):
+        return f'<DailyStat {self.day}: +{self.arrivals} -{self.pickups}>'
+
+
+class PackageArchive(db.Model):
+    """批量删除前归档的包裹（冷数据表，不再参与取件码唯一性约束）
+
+    SQLite 会复用已删除的最大 id，同一个包裹 id 可能被归档多次，因此归档表使用自己的主键，
+    原包裹 id 保存在 package_id 中。
+    """
+    __tablename__ = 'package_archive'
+    id = db.Column(db.Integer, primary_key=True)
+    package_id = db.Column(db.Integer, nullable=False, index=True)
+    customer_name = db.Column(db.String(100), nullable=False)
+    customer_email = db.Column(db.String(120), nullable=False)
+    shenzhen_tracking_number = db.Column(db.String(50), nullable=False)
+    pickup_code = db.Column(db.String(10), nullable=False)
+    shenzhen_arrival_date = db.Column(db.DateTime)
+    cafe_arrival_date = db.Column(db.DateTime)
+    pickup_date = db.Column(db.DateTime)
+    status = db.Column(db.String(20))
+    shenzhen_email_sent = db.Column(db.Boolean)
+    cafe_email_sent = db.Column(db.Boolean)
+    notes = db.Column(db.Text)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    pickup_deadline = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<PackageArchive {self.id} (package {self.package_id}): {self.customer_name} - {self.shenzhen_tracking_number}>'
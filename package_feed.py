@@ -0,0 +1,100 @@
+import json
+from datetime import datetime, timezone
+from sqlalchemy.orm import load_only
+from models import Package
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+# to_dict 中的每个字段: (需要加载的列, 取值函数)
+FIELDS = {
+    'id': (('id',), lambda p: p.id),
+    'customer_name': (('customer_name',), lambda p: p.customer_name),
+    'customer_email': (('customer_email',), lambda p: p.customer_email),
+    'shenzhen_tracking_number': (('shenzhen_tracking_number',), lambda p: p.shenzhen_tracking_number),
+    'pickup_code': (('pickup_code',), lambda p: p.pickup_code),
+    'shenzhen_arrival_date': (('shenzhen_arrival_date',), lambda p: _iso(p.shenzhen_arrival_date)),
+    'cafe_arrival_date': (('cafe_arrival_date',), lambda p: _iso(p.cafe_arrival_date)),
+    'pickup_date': (('pickup_date',), lambda p: _iso(p.pickup_date)),
+    'status': (('status',), lambda p: p.status),
+    'shenzhen_email_sent': (('shenzhen_email_sent',), lambda p: p.shenzhen_email_sent),
+    'cafe_email_sent': (('cafe_email_sent',), lambda p: p.cafe_email_sent),
+    'notes': (('notes',), lambda p: p.notes),
+    'updated_at': (('updated_at',), lambda p: _iso(p.updated_at)),
+    'latest_pickup_time': (('cafe_arrival_date', 'pickup_deadline'), lambda p: _iso(p.latest_pickup_time_paris)),
+    'is_overdue': (('status', 'cafe_arrival_date', 'pickup_deadline'), lambda p: p.is_overdue),
+}
+DEFAULT_FIELDS = [name for name in FIELDS if name != 'updated_at']  # 与 to_dict 输出一致
+
+
+def parse_fields(value):
+    """解析 fields=a,b,c 参数，未知字段抛出 ValueError"""
+    if not value:
+        return DEFAULT_FIELDS
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in FIELDS]
+    if unknown:
+        raise ValueError(f"未知字段: {', '.join(unknown)}")
+    return fields
+
+
+def parse_updated_since(value):
+    """解析 updated_since（ISO 8601，按UTC理解）"""
+    if not value:
+        return None
+    try:
+        since = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"updated_since 格式错误: {value}")
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    return since
+
+
+def build_query(fields, after=None, updated_since=None):
+    """按 id 升序的包裹查询，只加载投影字段需要的列"""
+    columns = {'id'}
+    for name in fields:
+        columns.update(FIELDS[name][0])
+    query = Package.query.options(load_only(*[getattr(Package, col) for col in sorted(columns)]))
+    if after is not None:
+        query = query.filter(Package.id > after)
+    if updated_since is not None:
+        query = query.filter(Package.updated_at >= updated_since)
+    return query.order_by(Package.id.asc())
+
+
+def serialize(package, fields):
+    return {name: FIELDS[name][1](package) for name in fields}
+
+
+def fetch_page(query, fields, limit):
+    """取一页结果，返回 (items, next_after)"""
+    rows = query.limit(limit + 1).all()
+    items = [serialize(package, fields) for package in rows[:limit]]
+    next_after = rows[limit - 1].id if len(rows) > limit else None
+    return items, next_after
+
+
+def _stream_rows(query, fields, batch_size):
+    # yield_per 按批从游标取行，不在内存中累积整张表
+    for package in query.yield_per(batch_size):
+        yield json.dumps(serialize(package, fields), ensure_ascii=False)
+
+
+def stream_ndjson(query, fields, batch_size):
+    """逐行输出 NDJSON"""
+    for line in _stream_rows(query, fields, batch_size):
+        yield line + '\n'
+
+
+def stream_json_array(query, fields, batch_size):
+    """以分块方式输出 JSON 数组，格式与旧版 /api/packages 相同"""
+    yield '['
+    first = True
+    for line in _stream_rows(query, fields, batch_size):
+        yield line if first else ',' + line
+        first = False
+    yield ']'
@@ -0,0 +1,129 @@
+import logging
+import os
+import time
+from flask import current_app
+from sqlalchemy import literal
+from sqlalchemy.exc import IntegrityError
+from models import db, Package, PackageQR
+from qr_cache import qr_key, render_qr_png
+
+logger = logging.getLogger(__name__)
+
+QR_BOX_SIZE = 6
+QR_ERROR = 'M'
+QR_BORDER = 2
+QUERY_CHUNK_SIZE = 500  # IN 查询每批的参数个数，兼容SQLite参数上限
+
+
+def content_prefix(base_url=None):
+    """包裹二维码内容的固定前缀，后面接取件码"""
+    base_url = base_url or current_app.config.get('BASE_URL', 'http://localhost:5000')
+    return f"{base_url.rstrip('/')}/mobile_pickup?code="
+
+
+def package_qr_content(pickup_code, base_url=None):
+    """包裹二维码编码的内容：带取件码的移动端取件页面网址"""
+    return content_prefix(base_url) + pickup_code
+
+
+def package_qr_key(content):
+    return qr_key(content, QR_BOX_SIZE, QR_ERROR, QR_BORDER)
+
+
+def _render(item):
+    """进程池中执行：生成一个包裹的二维码PNG"""
+    package_id, content = item
+    return package_id, content, render_qr_png(content, QR_BOX_SIZE, QR_ERROR, QR_BORDER)
+
+
+def _store(rows):
+    """保存 (package_id, content, png)，替换已有的旧二维码（不提交）"""
+    ids = [package_id for package_id, _, _ in rows]
+    for i in range(0, len(ids), QUERY_CHUNK_SIZE):
+        PackageQR.query.filter(PackageQR.package_id.in_(ids[i:i + QUERY_CHUNK_SIZE])) \
+            .delete(synchronize_session=False)
+    db.session.execute(PackageQR.__table__.insert(), [
+        {'package_id': package_id, 'content': content, 'png': png}
+        for package_id, content, png in rows
+    ])
+
+
+def get_package_qr(package_id, pickup_code):
+    """取包裹二维码，返回 (缓存键, PNG字节)
+
+    依次查进程内缓存、package_qr 表，都没有（或取件码已变化）时现场生成并保存。
+    """
+    content = package_qr_content(pickup_code)
+    key = package_qr_key(content)
+    cache = current_app.extensions['qr_cache']
+    png = cache.get(key)
+    if png is not None:
+        return key, png
+
+    row = db.session.get(PackageQR, package_id)
+    if row is not None and row.content == content:
+        png = row.png
+    else:
+        _, _, png = _render((package_id, content))
+        try:
+            _store([(package_id, content, png)])
+            db.session.commit()
+        except IntegrityError:
+            # 并发请求已经保存了同一个二维码
+            db.session.rollback()
+    cache.put(key, png, persist=False)
+    return key, png
+
+
+def delete_package_qrs(package_ids):
+    """删除包裹时一并删除其二维码（不提交）"""
+    for i in range(0, len(package_ids), QUERY_CHUNK_SIZE):
+        PackageQR.query.filter(PackageQR.package_id.in_(package_ids[i:i + QUERY_CHUNK_SIZE])) \
+            .delete(synchronize_session=False)
+
+
+def backfill_package_qrs(chunk_size=500, workers=None, progress=None):
+    """为缺少二维码或二维码已过期的包裹批量生成
+
+    按 id 顺序分块，每块在进程池中并行生成并单独提交；中断后重新运行会从未完成的包裹继续。
+    progress(done, total, elapsed) 在每块提交后调用。返回生成数量。
+    """
+    prefix = content_prefix()
+    workers = workers or os.cpu_count() or 1
+    pending = db.session.query(Package.id, Package.pickup_code) \
+        .outerjoin(PackageQR, PackageQR.package_id == Package.id) \
+        .filter(db.or_(PackageQR.package_id.is_(None),
+                       PackageQR.content != literal(prefix) + Package.pickup_code))
+    total = pending.count()
+    if total == 0:
+        return 0
+
+    executor = None
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=workers)
+    started = time.perf_counter()
+    done = 0
+    last_id = 0
+    try:
+        while True:
+            chunk = pending.filter(Package.id > last_id).order_by(Package.id).limit(chunk_size).all()
+            if not chunk:
+                break
+            items = [(package_id, prefix + pickup_code) for package_id, pickup_code in chunk]
+            if executor is not None:
+                rows = list(executor.map(_render, items, chunksize=max(1, len(items) // (workers * 4))))
+            else:
+                rows = [_render(item) for item in items]
+            _store(rows)
+            db.session.commit()
+
+            done += len(rows)
+            last_id = chunk[-1][0]
+            if progress:
+                progress(done, total, time.perf_counter() - started)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    logger.info(f"包裹二维码回填完成: {done} 个，用时 {time.perf_counter() - started:.2f} 秒")
+    return done
@@ -0,0 +1,142 @@
+import base64
+import threading
+import time
+from datetime import datetime
+from models import db, Package
+
+
+def encode_cursor(package):
+    """把排序键 (cafe_arrival_date, id) 编码为URL安全的游标"""
+    date = package.cafe_arrival_date.isoformat() if package.cafe_arrival_date else ''
+    raw = f'{date}|{package.id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析游标，格式错误时返回 None"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        date, package_id = raw.split('|')
+        return (datetime.fromisoformat(date) if date else None), int(package_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class KeysetPage:
+    """一页键集分页结果"""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+# 排序 (cafe_arrival_date DESC NULLS LAST, id DESC)，与 models 中的降序索引一致
+ORDER_DESC = (Package.cafe_arrival_date.desc().nullslast(), Package.id.desc())
+ORDER_ASC = (Package.cafe_arrival_date.asc().nullsfirst(), Package.id.asc())
+
+
+def _sort_key():
+    return db.tuple_(Package.cafe_arrival_date, Package.id)
+
+
+def _forward(query, key, limit):
+    """排序中位于游标之后的最多 limit 行
+
+    有到达日期的行用行值比较 (cafe_arrival_date, id) < 游标，日期为空的尾部单独查询，
+    有日期的行取完后才转到尾部；两段都是索引上的一次范围查找，代价与翻到第几页无关。
+    """
+    rows = []
+    if key is None or key[0] is not None:
+        dated = query.filter(Package.cafe_arrival_date.isnot(None))
+        if key is not None:
+            dated = dated.filter(_sort_key() < db.tuple_(*key))
+        rows = dated.order_by(*ORDER_DESC).limit(limit).all()
+        if len(rows) == limit:
+            return rows
+    undated = query.filter(Package.cafe_arrival_date.is_(None))
+    if key is not None and key[0] is None:
+        undated = undated.filter(Package.id < key[1])
+    return rows + undated.order_by(Package.id.desc()).limit(limit - len(rows)).all()
+
+
+def _backward(query, key, limit):
+    """排序中位于游标之前的最多 limit 行，按离游标由近到远（升序）返回"""
+    rows = []
+    dated = query.filter(Package.cafe_arrival_date.isnot(None))
+    if key[0] is None:
+        rows = query.filter(Package.cafe_arrival_date.is_(None), Package.id > key[1]) \
+            .order_by(Package.id.asc()).limit(limit).all()
+        if len(rows) == limit:
+            return rows
+    else:
+        dated = dated.filter(_sort_key() > db.tuple_(*key))
+    return rows + dated.order_by(*ORDER_ASC).limit(limit - len(rows)).all()
+
+
+def keyset_paginate(query, per_page, after=None, before=None):
+    """按 (cafe_arrival_date, id) 做键集分页，每页代价与页码无关（无 OFFSET 扫描）"""
+    after_key = decode_cursor(after)
+    before_key = decode_cursor(before)
+
+    if before_key is not None:
+        rows = _backward(query, before_key, per_page + 1)
+        has_more = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        return KeysetPage(
+            items,
+            next_cursor=encode_cursor(items[-1]) if items else before,
+            prev_cursor=encode_cursor(items[0]) if has_more and items else None,
+        )
+
+    rows = _forward(query, after_key, per_page + 1)
+    items = rows[:per_page]
+    return KeysetPage(
+        items,
+        next_cursor=encode_cursor(items[-1]) if len(rows) > per_page else None,
+        prev_cursor=encode_cursor(items[0]) if after_key is not None and items else None,
+    )
+
+
+class CountCache:
+    """短时缓存 COUNT(*) 结果，翻页时不必每次全表计数"""
+
+    def __init__(self, ttl=30, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > now:
+                return entry[0]
+        value = compute()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[key] = (value, now + self.ttl)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,102 @@
+import logging
+import random
+from flask import current_app
+from models import db, Package, PickupCodePool
+
+logger = logging.getLogger(__name__)
+
+CODE_SPACE = 10 ** 6  # 6位数字取件码
+QUERY_CHUNK_SIZE = 500  # IN 查询每批的参数个数，兼容SQLite参数上限
+
+
+def _insert_ignore_duplicates(codes):
+    """把新取件码登记到池中，池中已有的取件码直接忽略"""
+    if not codes:
+        return
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        insert = None
+
+    rows = [{'code': code, 'in_use': False} for code in codes]
+    if insert is not None:
+        db.session.execute(insert(PickupCodePool).on_conflict_do_nothing(index_elements=['code']), rows)
+        return
+
+    # 其他数据库：先过滤掉池中已有的取件码
+    existing = set()
+    for i in range(0, len(codes), QUERY_CHUNK_SIZE):
+        chunk = codes[i:i + QUERY_CHUNK_SIZE]
+        existing.update(code for (code,) in db.session.query(PickupCodePool.code)
+                        .filter(PickupCodePool.code.in_(chunk)))
+    rows = [row for row in rows if row['code'] not in existing]
+    if rows:
+        db.session.execute(PickupCodePool.__table__.insert(), rows)
+
+
+def refill_pool(size=None):
+    """向取件码池补充随机且未被占用的取件码，返回补充数量"""
+    size = size or current_app.config.get('PICKUP_CODE_POOL_REFILL', 1000)
+    candidates = [f'{n:06d}' for n in random.sample(range(CODE_SPACE), min(size, CODE_SPACE))]
+
+    # 池中已登记的取件码由唯一约束去重，这里只需排除取件码池启用前就已存在的包裹
+    taken = set()
+    for i in range(0, len(candidates), QUERY_CHUNK_SIZE):
+        chunk = candidates[i:i + QUERY_CHUNK_SIZE]
+        taken.update(code for (code,) in db.session.query(Package.pickup_code)
+                     .filter(Package.pickup_code.in_(chunk)))
+    free_codes = [code for code in candidates if code not in taken]
+
+    _insert_ignore_duplicates(free_codes)
+    logger.info(f"取件码池已补充 {len(free_codes)} 个候选取件码")
+    return len(free_codes)
+
+
+def _take_from_pool(count):
+    """从池中占用最多 count 个空闲取件码（一次往返），多进程并发时互不重复"""
+    ids = db.session.query(PickupCodePool.id).filter(PickupCodePool.in_use.is_(False)) \
+        .order_by(PickupCodePool.id).limit(count) \
+        .with_for_update(skip_locked=True).scalar_subquery()
+    result = db.session.execute(
+        db.update(PickupCodePool)
+        .where(PickupCodePool.id.in_(ids), PickupCodePool.in_use.is_(False))
+        .values(in_use=True)
+        .returning(PickupCodePool.code)
+        .execution_options(synchronize_session=False)
+    )
+    return [code for (code,) in result]
+
+
+def allocate_pickup_codes(count):
+    """分配 count 个唯一取件码
+
+    取件码在调用方的事务中被标记为占用：事务回滚时取件码自动回到空闲状态，
+    PostgreSQL 上通过 SKIP LOCKED 保证多个 gunicorn worker 不会拿到同一个取件码。
+    """
+    codes = []
+    max_rounds = 20  # 防止取件码空间耗尽时无限循环
+    for _ in range(max_rounds):
+        codes.extend(_take_from_pool(count - len(codes)))
+        if len(codes) >= count:
+            return codes
+        refill_pool(max(count - len(codes), current_app.config.get('PICKUP_CODE_POOL_REFILL', 1000)))
+    raise ValueError("无法生成唯一的取件码，请重试")
+
+
+def release_pickup_codes(codes):
+    """回收取件码（包裹删除后调用），使其可再次分配"""
+    codes = [code for code in codes if code]
+    _insert_ignore_duplicates(codes)  # 取件码池启用前分配的取件码先登记到池中
+    for i in range(0, len(codes), QUERY_CHUNK_SIZE):
+        chunk = codes[i:i + QUERY_CHUNK_SIZE]
+        db.session.execute(
+            db.update(PickupCodePool)
+            .where(PickupCodePool.code.in_(chunk))
+            .values(in_use=False)
+            .execution_options(synchronize_session=False)
+        )
+    if codes:
+        logger.info(f"已回收 {len(codes)} 个取件码")
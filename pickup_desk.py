@@ -0,0 +1,126 @@
+import threading
+import time
+from datetime import datetime
+from models import db, Package, to_paris
+from pickup_feed import pickup_item
+from stats_engine import new_counters, count_transition, record_transitions
+
+# 热缓存中每个待取件包裹保存的列，顺序与 pickup_item 的参数一致
+ROW_COLUMNS = (
+    Package.id,
+    Package.pickup_code,
+    Package.customer_name,
+    Package.shenzhen_tracking_number,
+    Package.cafe_arrival_date,
+    Package.pickup_deadline,
+)
+
+
+def active_item(row, now=None):
+    """由缓存行生成 pickup_item，逾期状态在读取时计算"""
+    deadline = row[-1]
+    overdue = deadline is not None and deadline < (now or datetime.utcnow())
+    return pickup_item(*row, overdue)
+
+
+class ActiveCodeCache:
+    """待取件包裹取件码的进程内热缓存，柜台核对取件码时不必查询数据库
+
+    本进程内的变更通过 change_feed 订阅即时失效；其他进程中的变更最长 ttl 秒后随整体重新加载生效。
+    缓存只用于查询展示，确认取件始终以数据库中的条件更新为准。
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 60
+        self._by_code = {}
+        self._code_by_id = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('PICKUP_CACHE_TTL', 60)
+        app.extensions['active_codes'] = self
+        feed = app.extensions.get('change_feed')
+        if feed is not None:
+            feed.subscribe(self._on_changes)
+
+    def load(self):
+        """一次查询加载全部待取件包裹"""
+        rows = db.session.query(*ROW_COLUMNS).filter(Package.status == 'cafe_arrived').all()
+        with self._lock:
+            self._by_code = {row.pickup_code: tuple(row) for row in rows}
+            self._code_by_id = {row.id: row.pickup_code for row in rows}
+            self._loaded_at = time.monotonic()
+
+    def get(self, code):
+        """取件码对应的待取件包裹行，不是待取件状态时返回 None"""
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            self.load()
+        row = self._by_code.get(code)
+        if row is not None:
+            return row
+        # 可能是其他进程中刚到达的包裹：按唯一索引查一次，命中后放入缓存
+        row = db.session.query(*ROW_COLUMNS).filter(
+            Package.pickup_code == code, Package.status == 'cafe_arrived'
+        ).first()
+        if row is None:
+            return None
+        row = tuple(row)
+        with self._lock:
+            self._by_code[code] = row
+            self._code_by_id[row[0]] = code
+        return row
+
+    def discard(self, package_id):
+        with self._lock:
+            code = self._code_by_id.pop(package_id, None)
+            if code is not None:
+                self._by_code.pop(code, None)
+
+    def clear(self):
+        with self._lock:
+            self._by_code = {}
+            self._code_by_id = {}
+            self._loaded_at = None
+
+    def _on_changes(self, events):
+        for event_type, data in events:
+            if event_type == 'resync':
+                self.clear()
+                return
+            # 到达和修改的包裹在下次查询时按唯一索引重新读取
+            self.discard(data.get('id'))
+
+
+def confirm_pickup(code):
+    """核对取件码并标记为已取件：一条带 status 条件的 UPDATE，并发确认时只有一个会成功
+
+    成功时返回 (id, 客户姓名, 深圳快递单号, 最晚取件时间)，同时记录日汇总；由调用方提交。
+    """
+    table = Package.__table__
+    now = datetime.utcnow()
+    row = db.session.execute(
+        table.update()
+        .where(table.c.pickup_code == code, table.c.status == 'cafe_arrived')
+        .values(status='picked_up', pickup_date=now, updated_at=now)
+        .returning(table.c.id, table.c.customer_name, table.c.shenzhen_tracking_number, table.c.pickup_deadline)
+    ).first()
+    if row is not None:
+        counters = new_counters()
+        count_transition(counters, 'cafe_arrived', 'picked_up', row.pickup_deadline, now, now)
+        record_transitions(counters)
+    return row
+
+
+def inactive_code_reason(code):
+    """取件码不是待取件状态时的说明，返回 (包裹行, 说明)；取件码不存在时包裹行为 None"""
+    package = db.session.query(Package.id, Package.status, Package.pickup_date) \
+        .filter(Package.pickup_code == code).first()
+    if package is None:
+        return None, '取件码不存在'
+    if package.status == 'picked_up':
+        picked_at = to_paris(package.pickup_date).strftime('%m-%d %H:%M') if package.pickup_date else '--'
+        return package, f'该包裹已于 {picked_at} 取走'
+    return package, '包裹尚未到达咖啡馆'
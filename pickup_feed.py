@@ -0,0 +1,92 @@
+import hashlib
+from datetime import datetime, timedelta
+from models import db, Package, to_paris
+
+
+def overdue_filter(now=None):
+    """逾期包裹: 仍待取件且已过最晚取件时间，走 (status, pickup_deadline) 索引"""
+    return db.and_(Package.status == 'cafe_arrived', Package.pickup_deadline < (now or datetime.utcnow()))
+
+
+def active_set_filter(recent_days):
+    """当前货架: 待取件的包裹，加上最近 recent_days 天内已取走的包裹（更早的属于历史记录）"""
+    cutoff = datetime.utcnow() - timedelta(days=recent_days)
+    return db.or_(
+        Package.status == 'cafe_arrived',
+        db.and_(Package.status == 'picked_up', Package.pickup_date >= cutoff)
+    )
+
+
+def pickup_codes_version():
+    """待取件包裹的数据版本: (数量, 最近更新时间, 逾期数量)
+
+    只做一次聚合查询，不取出任何行；逾期数量随时间变化，因此也计入版本。
+    """
+    now = datetime.utcnow()
+    count, last_updated, overdue = db.session.query(
+        db.func.count(Package.id),
+        db.func.max(Package.updated_at),
+        db.func.sum(db.case((Package.pickup_deadline < now, 1), else_=0))
+    ).filter(Package.status == 'cafe_arrived').one()
+    return count, last_updated, int(overdue or 0)
+
+
+def version_etag(version):
+    """由数据版本生成强 ETag"""
+    count, last_updated, overdue = version
+    raw = f"{count}|{last_updated.isoformat() if last_updated else ''}|{overdue}"
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def _paris(dt):
+    """UTC naive 时间转巴黎时间并格式化为 月-日 时:分"""
+    if dt is None:
+        return None
+    return to_paris(dt).strftime('%m-%d %H:%M')
+
+
+def pickup_item(package_id, pickup_code, customer_name, tracking_number, cafe_arrival_date, pickup_deadline,
+                is_overdue):
+    """一个待取件包裹的JSON表示（/api/pickup_codes 与变更推送共用）"""
+    return {
+        'id': package_id,
+        'pickup_code': pickup_code,
+        'customer_name': customer_name,
+        'shenzhen_tracking_number': tracking_number,
+        'cafe_arrival_date': _paris(cafe_arrival_date),
+        'latest_pickup_time': _paris(pickup_deadline),
+        'is_overdue': bool(is_overdue)
+    }
+
+
+def package_pickup_item(package):
+    """由 Package 对象生成 pickup_item，逾期状态在Python中计算"""
+    deadline = package.latest_pickup_time
+    overdue = deadline is not None and deadline < datetime.utcnow()
+    return pickup_item(package.id, package.pickup_code, package.customer_name,
+                       package.shenzhen_tracking_number, package.cafe_arrival_date, deadline, overdue)
+
+
+def pickup_codes_rows():
+    """只查询需要的列，逾期状态在SQL中计算"""
+    return [pickup_item(*row) for row in _pickup_rows_query(Package.status == 'cafe_arrived')
+            .order_by(Package.cafe_arrival_date.desc())]
+
+
+def overdue_rows(limit):
+    """逾期包裹，按最晚取件时间从早到晚，最多 limit 个"""
+    return [pickup_item(*row) for row in _pickup_rows_query(overdue_filter())
+            .order_by(Package.pickup_deadline, Package.id).limit(limit)]
+
+
+def _pickup_rows_query(condition):
+    now = datetime.utcnow()
+    return db.session.query(
+        Package.id,
+        Package.pickup_code,
+        Package.customer_name,
+        Package.shenzhen_tracking_number,
+        Package.cafe_arrival_date,
+        Package.pickup_deadline,
+        db.case((Package.pickup_deadline < now, True), else_=False).label('is_overdue')
+    ).filter(condition)
@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+"""
+预编译全部模板到 Jinja 字节码缓存（instance/jinja_cache）
+在部署的构建阶段运行，新启动的进程首次渲染页面和邮件时直接加载字节码，不必再从源码编译。
+用法: python precompile_templates.py
+"""
+
+import os
+import sys
+import time
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app, precompile_templates
+
+
+if __name__ == '__main__':
+    app = create_app(os.environ.get('FLASK_CONFIG', 'production'))
+    started = time.perf_counter()
+    count = precompile_templates(app)
+    print(f"✅ 已预编译 {count} 个模板，耗时 {(time.perf_counter() - started) * 1000:.0f} ms")
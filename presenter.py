@@ -0,0 +1,38 @@
+from datetime import datetime
+from models import STATUS_DISPLAY, STATUS_COLOR, to_paris
+
+
+class PackageView:
+    """模板使用的包裹视图行
+
+    巴黎时间、最晚取件时间、逾期状态等显示字段在构造时一次算好，模板中多次访问不再重复换算；
+    其他字段复制自原包裹对象，未加载的属性和方法转发给原对象。
+    """
+
+    def __init__(self, package, now):
+        # 复制已加载的列值，模板访问普通字段时不必经过 __getattr__ 转发
+        self.__dict__.update(package.__dict__)
+        self.package = package
+        self.latest_pickup_time = package.latest_pickup_time
+        self.cafe_arrival_date_paris = to_paris(package.cafe_arrival_date)
+        self.latest_pickup_time_paris = to_paris(self.latest_pickup_time)
+        self.pickup_date_paris = to_paris(package.pickup_date)
+        self.is_overdue = package.status == 'cafe_arrived' and self.latest_pickup_time is not None \
+            and now > self.latest_pickup_time
+        self.status_display = STATUS_DISPLAY.get(package.status, package.status)
+        self.status_color = STATUS_COLOR.get(package.status, 'secondary')
+
+    def __getattr__(self, name):
+        return getattr(self.package, name)
+
+
+def present(packages, now=None):
+    """把一页包裹转换为视图行，整页共用同一个当前时间"""
+    now = now or datetime.utcnow()
+    return [PackageView(package, now) for package in packages]
+
+
+def present_page(page, now=None):
+    """就地把分页结果中的包裹替换为视图行，返回该分页对象"""
+    page.items = present(page.items, now)
+    return page
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+批量清理包裹：按状态（及取件时间）分块删除，可先归档到 package_archive 表
+每块单独提交，中断后重新运行会继续删除剩余的包裹。
+用法: python purge_packages.py --status picked_up [--before-days 90] [--archive] [--chunk-size 500] [--yes]
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app
+from models import db, Package
+from bulk_ops import bulk_delete_packages
+
+
+def print_progress(done, total, elapsed):
+    rate = done / elapsed if elapsed > 0 else 0
+    print(f"进度: {done}/{total} ({done * 100 / total:.1f}%)，{rate:.0f} 个/秒")
+
+
+def purge_packages(status=None, before_days=None, archive=False, chunk_size=500, assume_yes=False):
+    """删除符合条件的包裹"""
+    app = create_app()
+
+    with app.app_context():
+        db.create_all()  # 创建 package_archive 表
+
+        conditions = []
+        if status:
+            conditions.append(Package.status == status)
+        if before_days is not None:
+            conditions.append(Package.pickup_date < datetime.utcnow() - timedelta(days=before_days))
+        condition = db.and_(*conditions) if conditions else None
+
+        query = Package.query if condition is None else Package.query.filter(condition)
+        count = query.count()
+        if count == 0:
+            print("没有找到要删除的包裹")
+            return
+        if not assume_yes:
+            answer = input(f"将删除 {count} 个包裹{'（先归档）' if archive else ''}，输入 yes 确认: ")
+            if answer.strip().lower() != 'yes':
+                print("已取消")
+                return
+
+        try:
+            deleted = bulk_delete_packages(condition, archive=archive, chunk_size=chunk_size,
+                                           progress=print_progress)
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ 删除失败: {str(e)}")
+            print("已完成的部分已提交，重新运行脚本即可继续。")
+            return
+
+        print(f"\n完成！共删除 {deleted} 个包裹")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='按条件批量删除包裹')
+    parser.add_argument('--status', choices=['shenzhen_arrived', 'cafe_arrived', 'picked_up'], help='只删除该状态的包裹')
+    parser.add_argument('--before-days', type=int, default=None, help='只删除取件时间早于N天前的包裹')
+    parser.add_argument('--archive', action='store_true', help='删除前归档到 package_archive 表')
+    parser.add_argument('--chunk-size', type=int, default=500, help='每批删除的包裹数量')
+    parser.add_argument('--yes', action='store_true', help='跳过确认提示')
+    args = parser.parse_args()
+    purge_packages(status=args.status, before_days=args.before_days, archive=args.archive,
+                   chunk_size=args.chunk_size, assume_yes=args.yes)
@@ -0,0 +1,116 @@
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+KEY_RE = re.compile(r'^[0-9a-f]{20}$')
+
+
+def qr_key(data, box_size=10, error='L', border=4):
+    """二维码资源的缓存键，同样的内容和参数总是得到同一个键（也用作 ETag）"""
+    raw = f'{data}|{box_size}|{error}|{border}'.encode('utf-8')
+    return hashlib.sha1(raw).hexdigest()[:20]
+
+
+def render_qr_png(data, box_size=10, error='L', border=4):
+    """生成二维码PNG字节"""
+    # qrcode 会连带导入 PIL，只在真正需要生成图片时导入，缩短启动时间
+    import qrcode
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=getattr(qrcode.constants, f'ERROR_CORRECT_{error}'),
+        box_size=box_size,
+        border=border,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+class QRCache:
+    """二维码图片缓存：进程内LRU + 磁盘存储
+
+    图片按 (内容, box_size, 纠错等级, 边框) 缓存，通过 /qr/<key>.png 以可缓存的图片返回，
+    不再每次请求都重新生成并以 base64 内嵌到页面中。
+    """
+
+    def __init__(self, app=None):
+        self.max_entries = 128
+        self.directory = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_entries = app.config.get('QR_CACHE_SIZE', 128)
+        self.directory = app.config.get('QR_CACHE_DIR') or os.path.join(app.instance_path, 'qr_cache')
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+        except OSError as e:
+            logger.warning(f"二维码缓存目录不可用，只使用内存缓存: {e}")
+            self.directory = None
+        app.extensions['qr_cache'] = self
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.png')
+
+    def _remember(self, key, png):
+        with self._lock:
+            self._entries[key] = png
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        """按键取PNG字节，内存和磁盘都没有时返回 None"""
+        if not KEY_RE.match(key):
+            return None
+        with self._lock:
+            png = self._entries.get(key)
+            if png is not None:
+                self._entries.move_to_end(key)
+                return png
+        if self.directory:
+            try:
+                with open(self._path(key), 'rb') as f:
+                    png = f.read()
+            except (OSError, ValueError):
+                return None
+            self._remember(key, png)
+            return png
+        return None
+
+    def put(self, key, png, persist=True):
+        """缓存PNG字节；persist=False 时只放进内存（图片已另有持久化存储）"""
+        self._remember(key, png)
+        if persist and self.directory:
+            # 先写临时文件再改名，避免其他进程读到写了一半的图片
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(png)
+                os.replace(tmp_path, self._path(key))
+            except OSError as e:
+                logger.warning(f"写入二维码缓存失败: {e}")
+
+    def ensure(self, data, box_size=10, error='L', border=4):
+        """确保二维码已缓存，返回缓存键"""
+        key = qr_key(data, box_size, error, border)
+        if self.get(key) is None:
+            self.put(key, render_qr_png(data, box_size, error, border))
+            logger.info(f"二维码已生成并缓存: {data} -> {key}")
+        return key
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -1,14 +1,14 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """
-集运管理系统启动脚本
-适用于Anaconda环境
+集运管理系统启动脚本（本地开发）
+适用于Anaconda环境；生产环境见 wsgi.py 和 gunicorn.conf.py
 """
 
 import os
 
 # 导入应用
-from app import create_app
+from app import create_app, init_database
 
 if __name__ == '__main__':
     print("🚀 启动集运管理系统...")
@@ -33,10 +33,9 @@ if __name__ == '__main__':
     app = create_app()
     
     # 创建数据库表
-    with app.app_context():
-        from models import db
-        db.create_all()
-        print("✅ 数据库初始化完成")
+    init_database(app)
+    print("✅ 数据库初始化完成")
     
-    # 运行应用 - 禁用自动重载以避免watchdog问题
-    app.run(debug=True, host='0.0.0.0', port=5000, use_reloader=False) 
\ No newline at end of file
+    # 本地开发服务器（单进程），生产环境使用 gunicorn -c gunicorn.conf.py wsgi:app
+    # 禁用自动重载以避免watchdog问题
+    app.run(debug=app.config['DEBUG'], host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), use_reloader=False)
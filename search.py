@@ -0,0 +1,127 @@
+import logging
+import re
+import sqlite3
+from sqlalchemy import DDL, event, inspect, text
+from models import db, Package
+
+logger = logging.getLogger(__name__)
+
+SEARCH_COLUMNS = ('customer_name', 'customer_email', 'shenzhen_tracking_number', 'pickup_code')
+PICKUP_CODE_RE = re.compile(r'^\d{6}$')
+MIN_INDEXED_TERM = 3  # 三元组索引至少需要3个字符
+
+# SQLite: FTS5 trigram 外部内容表，由触发器与 package 表保持同步（需要 SQLite 3.34+）
+_cols = ', '.join(SEARCH_COLUMNS)
+_new_cols = ', '.join(f'new.{col}' for col in SEARCH_COLUMNS)
+_old_cols = ', '.join(f'old.{col}' for col in SEARCH_COLUMNS)
+SQLITE_FTS_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS package_fts USING fts5({_cols}, "
+    f"content='package', content_rowid='id', tokenize='trigram')",
+    f"CREATE TRIGGER IF NOT EXISTS package_fts_ai AFTER INSERT ON package BEGIN "
+    f"INSERT INTO package_fts(rowid, {_cols}) VALUES (new.id, {_new_cols}); END",
+    f"CREATE TRIGGER IF NOT EXISTS package_fts_ad AFTER DELETE ON package BEGIN "
+    f"INSERT INTO package_fts(package_fts, rowid, {_cols}) VALUES ('delete', old.id, {_old_cols}); END",
+    f"CREATE TRIGGER IF NOT EXISTS package_fts_au AFTER UPDATE OF {_cols} ON package BEGIN "
+    f"INSERT INTO package_fts(package_fts, rowid, {_cols}) VALUES ('delete', old.id, {_old_cols}); "
+    f"INSERT INTO package_fts(rowid, {_cols}) VALUES (new.id, {_new_cols}); END",
+]
+
+# PostgreSQL: 每个搜索列一个 pg_trgm GIN 索引，ILIKE '%词%' 可走 BitmapOr
+POSTGRES_TRGM_DDL = ["CREATE EXTENSION IF NOT EXISTS pg_trgm"] + [
+    f"CREATE INDEX IF NOT EXISTS ix_package_{col}_trgm ON package USING gin ({col} gin_trgm_ops)"
+    for col in SEARCH_COLUMNS
+]
+
+
+def _sqlite_supports_trigram(*args, **kwargs):
+    return sqlite3.sqlite_version_info >= (3, 34, 0)
+
+
+for _statement in SQLITE_FTS_DDL:
+    event.listen(Package.__table__, 'after_create',
+                 DDL(_statement).execute_if(dialect='sqlite', callable_=_sqlite_supports_trigram))
+event.listen(Package.__table__, 'before_drop',
+             DDL("DROP TABLE IF EXISTS package_fts").execute_if(dialect='sqlite'))
+
+
+def ensure_search_index():
+    """为已存在的 package 表补建搜索索引（新建表时由 after_create 事件自动创建）"""
+    engine = db.engine
+    dialect = engine.dialect.name
+    try:
+        if dialect == 'sqlite' and _sqlite_supports_trigram():
+            created = not inspect(engine).has_table('package_fts')
+            with engine.begin() as conn:
+                for statement in SQLITE_FTS_DDL:
+                    conn.execute(text(statement))
+                if created:
+                    conn.execute(text("INSERT INTO package_fts(package_fts) VALUES ('rebuild')"))
+                    logger.info("已为现有包裹建立 FTS5 搜索索引")
+        elif dialect == 'postgresql':
+            with engine.begin() as conn:
+                for statement in POSTGRES_TRGM_DDL:
+                    conn.execute(text(statement))
+    except Exception as e:
+        logger.warning(f"创建搜索索引失败，搜索将退回 LIKE 全表扫描: {e}")
+    _backend_cache.pop(str(engine.url), None)
+
+
+_backend_cache = {}
+
+
+def _search_backend():
+    """当前数据库可用的搜索方式: fts5 / trgm / like"""
+    engine = db.engine
+    key = str(engine.url)
+    backend = _backend_cache.get(key)
+    if backend is None:
+        backend = 'like'
+        try:
+            if engine.dialect.name == 'sqlite' and inspect(engine).has_table('package_fts'):
+                backend = 'fts5'
+            elif engine.dialect.name == 'postgresql':
+                with engine.connect() as conn:
+                    if conn.execute(text("SELECT 1 FROM pg_indexes WHERE indexname = 'ix_package_customer_name_trgm'")).first():
+                        backend = 'trgm'
+        except Exception as e:
+            logger.warning(f"检测搜索索引失败: {e}")
+        _backend_cache[key] = backend
+    return backend
+
+
+def _escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def apply_search(query, term):
+    """在查询上应用搜索条件
+
+    6位数字取件码和完整快递单号先走唯一索引精确匹配；否则按数据库使用 FTS5 / pg_trgm 索引做子串匹配，
+    少于3个字符的搜索词无法使用三元组索引，退回 LIKE。
+    """
+    term = term.strip()
+    if not term:
+        return query
+
+    # 精确匹配快速路径
+    if PICKUP_CODE_RE.match(term):
+        exact = db.session.query(Package.id).filter(Package.pickup_code == term).first()
+    else:
+        exact = db.session.query(Package.id).filter(Package.shenzhen_tracking_number == term).first()
+    if exact:
+        return query.filter(Package.id == exact[0])
+
+    pattern = f'%{_escape_like(term)}%'
+    backend = _search_backend() if len(term) >= MIN_INDEXED_TERM else 'like'
+    if backend == 'fts5':
+        phrase = '"' + term.replace('"', '""') + '"'
+        matched = text("SELECT rowid FROM package_fts WHERE package_fts MATCH :phrase") \
+            .bindparams(phrase=phrase).columns(rowid=db.Integer)
+        return query.filter(Package.id.in_(matched))
+    if backend == 'trgm':
+        return query.filter(db.or_(*[
+            getattr(Package, col).ilike(pattern, escape='\\') for col in SEARCH_COLUMNS
+        ]))
+    return query.filter(db.or_(*[
+        getattr(Package, col).like(pattern, escape='\\') for col in SEARCH_COLUMNS
+    ]))
@@ -0,0 +1,145 @@
+import logging
+import smtplib
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 连接被服务器断开（空闲超时、421 等）时重连一次再发送
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError)
+# 只与单封邮件有关的错误（收件人、发件人或内容被拒），服务器已复位会话，连接可以继续使用
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+class SMTPConnectionPool:
+    """可复用的SMTP连接池
+
+    每个发件线程持有一个长连接，同一会话内连续发送多封邮件，避免每封邮件都重新握手（TLS + 登录）。
+    单个会话达到 MAIL_MAX_EMAILS 封后由 Flask-Mail 自动重连，空闲超过 MAIL_POOL_IDLE_TIMEOUT 秒的
+    连接在下次使用前关闭重建。所有打开的连接登记在册，停止发件时由 close_all() 统一关闭。
+    接口与 flask_mail.Mail 兼容（app 属性和 send 方法）。
+    """
+
+    def __init__(self, mail, idle_timeout=None):
+        self.mail = mail
+        self.app = mail.app
+        self.idle_timeout = idle_timeout or self.app.config.get('MAIL_POOL_IDLE_TIMEOUT', 60)
+        self._local = threading.local()
+        self._connections = set()  # 各线程打开的连接
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'sessions_opened': 0,
+            'reconnects': 0,
+            'messages_sent': 0,
+            'send_failures': 0,
+            'send_seconds': 0.0,
+        }
+
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for key, value in deltas.items():
+                self._stats[key] += value
+
+    def _open(self):
+        """为当前线程建立新的SMTP会话"""
+        conn = self.mail.connect()
+        conn.__enter__()
+        with self._stats_lock:
+            self._connections.add(conn)
+        self._local.conn = conn
+        self._local.last_used = time.monotonic()
+        self._count(sessions_opened=1)
+        return conn
+
+    def _get_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and time.monotonic() - self._local.last_used > self.idle_timeout:
+            self.close()
+            conn = None
+        return conn or self._open()
+
+    def send(self, msg):
+        """通过当前线程的长连接发送一封邮件"""
+        started = time.perf_counter()
+        try:
+            conn = self._get_connection()
+            try:
+                conn.send(msg)
+            except RECONNECT_ERRORS as e:
+                logger.warning(f"SMTP连接已断开，重新连接: {e}")
+                self._discard()
+                self._count(reconnects=1)
+                conn = self._open()
+                conn.send(msg)
+        except MESSAGE_ERRORS:
+            # 这封邮件被拒，会话保留给后面的邮件
+            self._local.last_used = time.monotonic()
+            self._count(send_failures=1, send_seconds=time.perf_counter() - started)
+            raise
+        except (*RECONNECT_ERRORS, OSError):
+            # 连接本身出错（smtplib 的其他异常也属于 OSError），丢弃会话，下一封邮件重新连接
+            self._discard()
+            self._count(send_failures=1, send_seconds=time.perf_counter() - started)
+            raise
+        except Exception:
+            # 邮件本身的问题（如 Flask-Mail 的 BadHeaderError），与连接无关
+            self._count(send_failures=1, send_seconds=time.perf_counter() - started)
+            raise
+
+        self._local.last_used = time.monotonic()
+        # Flask-Mail 在达到 MAIL_MAX_EMAILS 后会自动重连并把计数清零
+        reconnected = bool(self.mail.state.max_emails) and conn.num_emails == 0
+        self._count(messages_sent=1, sessions_opened=int(reconnected),
+                    send_seconds=time.perf_counter() - started)
+
+    def _discard(self):
+        """丢弃当前线程的连接（不发送QUIT）"""
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        self._unregister(conn)
+        if conn is not None and conn.host:
+            try:
+                conn.host.close()
+            except Exception:
+                pass
+
+    def _unregister(self, conn):
+        with self._stats_lock:
+            self._connections.discard(conn)
+
+    def _quit(self, conn):
+        try:
+            conn.__exit__(None, None, None)
+        except Exception as e:
+            logger.debug(f"关闭SMTP连接时出错: {e}")
+
+    def close(self):
+        """正常关闭当前线程的连接"""
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            self._unregister(conn)
+            self._quit(conn)
+
+    def close_all(self):
+        """关闭所有线程打开的连接（发件worker已停止后调用）"""
+        with self._stats_lock:
+            connections = list(self._connections)
+            self._connections.clear()
+        for conn in connections:
+            self._quit(conn)
+        self._local.conn = None
+        if connections:
+            logger.info(f"已关闭 {len(connections)} 个SMTP连接")
+
+    def stats(self):
+        """吞吐量统计"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats['open_sessions'] = len(self._connections)
+        stats['send_seconds'] = round(stats['send_seconds'], 3)
+        stats['messages_per_second'] = round(stats['messages_sent'] / stats['send_seconds'], 2) \
+            if stats['send_seconds'] else 0.0
+        stats['messages_per_session'] = round(stats['messages_sent'] / stats['sessions_opened'], 2) \
+            if stats['sessions_opened'] else 0.0
+        return stats
@@ -0,0 +1,175 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from models import db, Package, DailyStat
+from pagination import CountCache
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ('shenzhen_arrived', 'cafe_arrived', 'picked_up')
+COUNTERS = ('arrivals', 'pickups', 'overdue')
+MAX_SERIES_DAYS = 366
+
+
+def new_counters():
+    return defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+
+
+def _upsert_counters(session, counters):
+    """把 {day: {arrivals, pickups, overdue}} 累加到 daily_stat 表"""
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        insert = None
+
+    for day, values in counters.items():
+        if not any(values.values()):
+            continue
+        if insert is not None:
+            stmt = insert(DailyStat).values(day=day, **values)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['day'],
+                set_={name: getattr(DailyStat, name) + getattr(stmt.excluded, name) for name in COUNTERS}
+            )
+            session.execute(stmt)
+            continue
+
+        # 其他数据库：先累加，当天还没有记录时再插入
+        result = session.execute(
+            db.update(DailyStat).where(DailyStat.day == day)
+            .values({name: getattr(DailyStat, name) + values[name] for name in COUNTERS})
+        )
+        if result.rowcount == 0:
+            session.execute(DailyStat.__table__.insert().values(day=day, **values))
+
+
+def count_transition(counters, old_status, new_status, deadline=None, pickup_date=None, now=None):
+    """把一次状态变更计入按天的计数器（deadline 为最晚取件时间，用于判断是否逾期取件）"""
+    if old_status == new_status:
+        return
+    now = now or datetime.utcnow()
+    day = now.date()
+    if new_status == 'cafe_arrived':
+        counters[day]['arrivals'] += 1
+    elif new_status == 'picked_up':
+        counters[day]['pickups'] += 1
+        if deadline and (pickup_date or now) > deadline:
+            counters[day]['overdue'] += 1
+
+
+def record_transitions(counters, session=None):
+    """批量接口：绕过ORM的批量状态更新在同一事务内调用此函数记录计数"""
+    _upsert_counters(session or db.session, counters)
+
+
+@event.listens_for(Session, 'before_flush')
+def _track_status_changes(session, flush_context, instances):
+    """在 flush 前检测包裹状态变更，与变更本身在同一事务中更新日汇总"""
+    counters = None
+    now = datetime.utcnow()
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Package):
+            continue
+        history = inspect(obj).attrs.status.history
+        if not history.added:
+            continue
+        old_status = history.deleted[0] if history.deleted else None
+        if counters is None:
+            counters = new_counters()
+        count_transition(counters, old_status, history.added[0], obj.latest_pickup_time, obj.pickup_date, now)
+    if counters:
+        _upsert_counters(session, counters)
+
+
+def rebuild_daily_stats():
+    """根据现有包裹重新计算日汇总（用于首次启用或数据修复）"""
+    counters = new_counters()
+    rows = db.session.query(Package.cafe_arrival_date, Package.pickup_date, Package.pickup_deadline).filter(
+        db.or_(Package.cafe_arrival_date.isnot(None), Package.pickup_date.isnot(None))
+    ).yield_per(1000)
+    for cafe_arrival_date, pickup_date, pickup_deadline in rows:
+        if cafe_arrival_date:
+            counters[cafe_arrival_date.date()]['arrivals'] += 1
+        if pickup_date:
+            counters[pickup_date.date()]['pickups'] += 1
+            if pickup_deadline and pickup_date > pickup_deadline:
+                counters[pickup_date.date()]['overdue'] += 1
+
+    db.session.query(DailyStat).delete(synchronize_session=False)
+    if counters:
+        db.session.execute(DailyStat.__table__.insert(),
+                           [{'day': day, **values} for day, values in counters.items()])
+    db.session.commit()
+    logger.info(f"日汇总已重建: {len(counters)} 天")
+
+
+def ensure_daily_stats():
+    """日汇总表为空而已有包裹时，补算历史数据"""
+    if DailyStat.query.first() is None and Package.query.first() is not None:
+        rebuild_daily_stats()
+
+
+def status_summary():
+    """一次 GROUP BY 查询得到各状态数量和当前逾期数量"""
+    now = datetime.utcnow()
+    rows = db.session.query(
+        Package.status,
+        db.func.count(Package.id),
+        db.func.sum(db.case((Package.pickup_deadline < now, 1), else_=0))
+    ).group_by(Package.status).all()
+
+    summary = dict.fromkeys(STATUSES, 0)
+    summary['total'] = 0
+    summary['overdue'] = 0
+    for status, count, past_deadline in rows:
+        summary['total'] += count
+        if status in summary:
+            summary[status] = count
+        if status == 'cafe_arrived':
+            summary['overdue'] = int(past_deadline or 0)
+
+    today = db.session.get(DailyStat, datetime.utcnow().date())
+    summary['today'] = today.arrivals if today else 0
+    summary['today_pickups'] = today.pickups if today else 0
+    return summary
+
+
+def daily_series(days):
+    """最近 days 天的日汇总，没有记录的日期补0"""
+    end = datetime.utcnow().date()
+    start = end - timedelta(days=days - 1)
+    rows = {row.day: row for row in DailyStat.query.filter(DailyStat.day >= start)}
+    series = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        row = rows.get(day)
+        series.append(row.to_dict() if row else {'date': day.isoformat(), **dict.fromkeys(COUNTERS, 0)})
+    return series
+
+
+class StatsEngine:
+    """统计数据的短时缓存"""
+
+    def __init__(self, app=None):
+        self.cache = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.cache = CountCache(ttl=app.config.get('STATS_CACHE_TTL', 30))
+        app.extensions['stats_engine'] = self
+
+    def summary(self):
+        return self.cache.get('summary', status_summary)
+
+    def series(self, days):
+        days = max(1, min(days, MAX_SERIES_DAYS))
+        return self.cache.get(('series', days), lambda: daily_series(days))
+
+    def clear(self):
+        self.cache.clear()
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+发件队列测试：在本进程内启动一个SMTP替身服务器，直接调用 process_batch 发送
+运行: python -m pytest -q test_mail_queue.py
+"""
+
+import os
+import socketserver
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app, init_database
+from models import db, Package, EmailJob
+from flask_mail import Message
+from mail_queue import enqueue_emails
+
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    """最简SMTP服务器：记录收到的邮件和会话数，拒绝 reject 中的收件人（550）"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeSMTPHandler)
+        self.messages = []  # (发件人, 收件人列表)
+        self.sessions = 0
+        self.open_sessions = 0
+        self.quits = 0
+        self.reject = set()
+        self.lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def wait_closed(self, timeout=2):
+        """等待所有会话断开，返回是否全部断开"""
+        deadline = time.monotonic() + timeout
+        while self.open_sessions and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.open_sessions == 0
+
+    def recipients(self):
+        with self.lock:
+            return [rcpt for _, rcpts in self.messages for rcpt in rcpts]
+
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.sessions += 1
+            server.open_sessions += 1
+        try:
+            self.converse(server)
+        finally:
+            with server.lock:
+                server.open_sessions -= 1
+
+    def converse(self, server):
+        sender, rcpts = None, []
+        self.reply('220 fake-smtp ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 fake-smtp')
+            elif verb == 'MAIL':
+                sender, rcpts = command.split(':', 1)[1].strip(' <>'), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                rcpt = command.split(':', 1)[1].strip(' <>')
+                if rcpt in server.reject:
+                    self.reply('550 mailbox unavailable')
+                else:
+                    rcpts.append(rcpt)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 end with .')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                with server.lock:
+                    server.messages.append((sender, rcpts))
+                self.reply('250 queued')
+            elif verb in ('RSET', 'NOOP'):
+                sender, rcpts = None, []
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                with server.lock:
+                    server.quits += 1
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('502 not implemented')
+
+
+@pytest.fixture
+def smtp_server():
+    server = FakeSMTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def app(smtp_server):
+    app = create_app('testing')
+    app.config.update(
+        MAIL_SERVER='127.0.0.1',
+        MAIL_PORT=smtp_server.port,
+        MAIL_USE_TLS=False,
+        MAIL_USE_SSL=False,
+        MAIL_USERNAME='shop@example.com',
+        MAIL_PASSWORD=None,
+        MAIL_SUPPRESS_SEND=False,  # TESTING 下 Flask-Mail 默认不真正发送
+        MAIL_MAX_ATTEMPTS=3,
+        MAIL_RETRY_BACKOFF=30,
+        MAIL_QUEUE_LEASE=300,
+        MAIL_QUEUE_BATCH_SIZE=20,
+    )
+    queue = app.extensions['mail_queue']
+    queue.mail.state = queue.mail.init_app(app)  # 按新的配置重新初始化 Flask-Mail
+    init_database(app)
+    with app.app_context():
+        yield app
+        queue.pool.close()
+        db.session.remove()
+
+
+@pytest.fixture
+def queue(app):
+    return app.extensions['mail_queue']
+
+
+def make_packages(count, status='shenzhen_arrived'):
+    packages = [
+        Package(
+            customer_name=f'客户{i}',
+            customer_email=f'customer{i}@example.com',
+            shenzhen_tracking_number=f'SF{1000000000 + i}',
+            pickup_code=f'{100000 + i}',
+            status=status,
+            cafe_arrival_date=datetime.utcnow() if status == 'cafe_arrived' else None,
+        )
+        for i in range(count)
+    ]
+    db.session.add_all(packages)
+    db.session.commit()
+    return [package.id for package in packages]
+
+
+def jobs_by_package(email_type='shenzhen'):
+    return {job.package_id: job for job in EmailJob.query.filter_by(email_type=email_type)}
+
+
+def make_due():
+    """把排队中的任务的下次尝试时间提前到现在，模拟退避时间已过"""
+    db.session.execute(db.update(EmailJob).where(EmailJob.status == 'pending')
+                       .values(next_attempt_at=datetime.utcnow() - timedelta(seconds=1)))
+    db.session.commit()
+
+
+def test_enqueue_is_idempotent_per_package_and_type(queue, smtp_server):
+    ids = make_packages(3)
+    assert enqueue_emails(ids, 'shenzhen') == 3
+    assert enqueue_emails(ids + ids, 'shenzhen') == 0
+    db.session.commit()
+    assert EmailJob.query.count() == 3
+
+    # 不同邮件类型各自一个任务
+    assert enqueue_emails(ids[:1], 'cafe') == 1
+    db.session.commit()
+    assert EmailJob.query.count() == 4
+
+    queue.process_batch()
+    assert all(job.status == 'sent' for job in EmailJob.query)
+    assert len(smtp_server.messages) == 4
+
+    # 已发送的任务只有 force=True 时才重新排队
+    assert enqueue_emails(ids, 'shenzhen') == 0
+    assert enqueue_emails(ids[:2], 'shenzhen', force=True) == 2
+    db.session.commit()
+    jobs = jobs_by_package()
+    assert [jobs[i].status for i in ids] == ['pending', 'pending', 'sent']
+    assert jobs[ids[0]].attempts == 0
+    assert EmailJob.query.count() == 4
+
+    queue.process_batch()
+    assert len(smtp_server.messages) == 6
+
+
+def test_enqueue_skips_missing_packages_and_unknown_types(app):
+    ids = make_packages(1)
+    assert enqueue_emails(ids + [9999], 'shenzhen') == 1
+    with pytest.raises(ValueError):
+        enqueue_emails(ids, 'unknown')
+
+
+def test_failed_send_retries_with_backoff_then_fails(queue, smtp_server):
+    ids = make_packages(2)
+    smtp_server.reject.add('customer1@example.com')
+    enqueue_emails(ids, 'shenzhen')
+    db.session.commit()
+
+    before = datetime.utcnow()
+    assert queue.process_batch() == 2
+    jobs = jobs_by_package()
+    assert jobs[ids[0]].status == 'sent'
+    failed = jobs[ids[1]]
+    assert (failed.status, failed.attempts) == ('pending', 1)
+    assert failed.last_error
+    assert failed.next_attempt_at >= before + timedelta(seconds=30)
+
+    # 退避时间未到，不会重试
+    assert queue.process_batch() == 0
+
+    make_due()
+    assert queue.process_batch() == 1
+    failed = jobs_by_package()[ids[1]]
+    assert (failed.status, failed.attempts) == ('pending', 2)
+    assert failed.next_attempt_at >= datetime.utcnow() + timedelta(seconds=50)  # 第二次退避 60 秒
+
+    # 达到 MAIL_MAX_ATTEMPTS 后标记为 failed，不再重试
+    make_due()
+    assert queue.process_batch() == 1
+    failed = jobs_by_package()[ids[1]]
+    assert (failed.status, failed.attempts) == ('failed', 3)
+    make_due()
+    assert queue.process_batch() == 0
+
+    assert smtp_server.recipients() == ['customer0@example.com']
+    assert db.session.get(Package, ids[1]).shenzhen_email_sent is False
+
+    # 失败的任务可以重新入队
+    smtp_server.reject.clear()
+    assert enqueue_emails([ids[1]], 'shenzhen') == 1
+    db.session.commit()
+    assert queue.process_batch() == 1
+    assert db.session.get(Package, ids[1]).shenzhen_email_sent is True
+
+
+def test_expired_sending_lease_is_reclaimed(queue, smtp_server):
+    ids = make_packages(2)
+    enqueue_emails(ids, 'shenzhen')
+    db.session.commit()
+    # 模拟一个worker领取任务后崩溃（租约已过期），另一个任务仍在发送中
+    now = datetime.utcnow()
+    for package_id, locked_at in ((ids[0], now - timedelta(seconds=301)), (ids[1], now)):
+        db.session.execute(db.update(EmailJob).where(EmailJob.package_id == package_id)
+                           .values(status='sending', locked_at=locked_at))
+    db.session.commit()
+
+    assert queue.process_batch() == 1
+    jobs = jobs_by_package()
+    assert jobs[ids[0]].status == 'sent'
+    assert jobs[ids[1]].status == 'sending'
+    assert smtp_server.recipients() == ['customer0@example.com']
+
+
+def test_ledger_marks_only_sent_messages(queue, smtp_server):
+    ids = make_packages(4, status='cafe_arrived')
+    smtp_server.reject.update({'customer1@example.com', 'customer3@example.com'})
+    enqueue_emails(ids, 'cafe')
+    db.session.commit()
+
+    assert queue.process_batch() == 4
+    sent_flags = {package.id: package.cafe_email_sent for package in Package.query}
+    assert sent_flags == {ids[0]: True, ids[1]: False, ids[2]: True, ids[3]: False}
+    assert not any(package.shenzhen_email_sent for package in Package.query)
+    jobs = jobs_by_package('cafe')
+    assert [jobs[i].status for i in ids] == ['sent', 'pending', 'sent', 'pending']
+    assert sorted(smtp_server.recipients()) == ['customer0@example.com', 'customer2@example.com']
+    # 收件人被拒不影响会话，整批只用一个连接
+    assert smtp_server.sessions == 1
+    assert queue.pool.stats()['send_failures'] == 2
+
+
+def test_batches_share_one_smtp_session(queue, smtp_server):
+    ids = make_packages(30)
+    enqueue_emails(ids, 'shenzhen')
+    db.session.commit()
+
+    assert queue.process_batch() == 20
+    assert queue.process_batch() == 10
+    assert queue.process_batch() == 0
+
+    assert len(smtp_server.messages) == 30
+    assert smtp_server.sessions == 1
+    assert all(package.shenzhen_email_sent for package in Package.query)
+    stats = queue.pool.stats()
+    assert (stats['messages_sent'], stats['sessions_opened']) == (30, 1)
+
+
+def test_close_all_quits_sessions_opened_by_other_threads(app, queue, smtp_server):
+    def send_from_thread(i):
+        with app.app_context():
+            queue.pool.send(Message('测试', sender='shop@example.com', recipients=[f'customer{i}@example.com'],
+                                    body='hello'))
+
+    threads = [threading.Thread(target=send_from_thread, args=(i,)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert smtp_server.open_sessions == 3
+    assert queue.pool.stats()['open_sessions'] == 3
+
+    queue.pool.close_all()
+    assert smtp_server.wait_closed()
+    assert smtp_server.quits == 3
+    assert queue.pool.stats()['open_sessions'] == 0
+
+
+def test_stop_closes_worker_sessions(app, queue, smtp_server):
+    app.config.update(MAIL_QUEUE_WORKERS=2, MAIL_QUEUE_POLL_INTERVAL=60)
+    ids = make_packages(5)
+    enqueue_emails(ids, 'shenzhen')
+    db.session.commit()
+
+    queue.ensure_started()
+    deadline = time.monotonic() + 5
+    while len(smtp_server.messages) < 5 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    queue.stop(timeout=5)
+
+    assert len(smtp_server.messages) == 5
+    assert not any(thread.is_alive() for thread in threading.enumerate() if thread.name.startswith('mail-worker'))
+    assert smtp_server.wait_closed()
+    assert queue.pool.stats()['open_sessions'] == 0
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+键集分页测试：逐页前后翻页与完整排序一致，深页查询是索引上的范围查找（EXPLAIN QUERY PLAN）
+运行: python -m pytest -q test_pagination.py
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app, init_database
+from models import db, Package
+from pagination import keyset_paginate, encode_cursor
+
+COUNT = 3000
+PER_PAGE = 20
+
+
+@pytest.fixture(scope='module')
+def app():
+    app = create_app('testing')
+    init_database(app)
+    with app.app_context():
+        start = datetime(2026, 1, 1)
+        db.session.execute(Package.__table__.insert(), [
+            {
+                'customer_name': f'客户{i}',
+                'customer_email': f'customer{i}@example.com',
+                'shenzhen_tracking_number': f'SF{1000000000 + i}',
+                'pickup_code': f'{100000 + i}',
+                'status': ('shenzhen_arrived', 'cafe_arrived', 'picked_up')[i % 3],
+                # 每10个包裹有1个没有到达日期，且有多个包裹到达时间相同
+                'cafe_arrival_date': None if i % 10 == 0 else start + timedelta(hours=i // 4),
+            }
+            for i in range(COUNT)
+        ])
+        db.session.commit()
+        db.session.execute(db.text('ANALYZE'))
+        yield app
+        db.session.remove()
+
+
+def expected_order(query):
+    """完整排序 (cafe_arrival_date DESC NULLS LAST, id DESC)"""
+    rows = query.all()
+    dated = sorted((p for p in rows if p.cafe_arrival_date), key=lambda p: (p.cafe_arrival_date, p.id), reverse=True)
+    undated = sorted((p for p in rows if not p.cafe_arrival_date), key=lambda p: p.id, reverse=True)
+    return [p.id for p in dated + undated]
+
+
+@pytest.mark.parametrize('status', [None, 'cafe_arrived'])
+def test_pages_forward_and_backward_match_full_order(app, status):
+    query = Package.query
+    if status:
+        query = query.filter_by(status=status)
+    expected = expected_order(query)
+
+    pages = []
+    page = keyset_paginate(query, PER_PAGE)
+    assert not page.has_prev
+    while True:
+        pages.append([p.id for p in page])
+        if not page.has_next:
+            break
+        page = keyset_paginate(query, PER_PAGE, after=page.next_cursor)
+    assert [package_id for ids in pages for package_id in ids] == expected
+    assert all(len(ids) == PER_PAGE for ids in pages[:-1])
+
+    # 从最后一页往回翻，每页与向前翻时相同
+    for ids in reversed(pages[:-1]):
+        page = keyset_paginate(query, PER_PAGE, before=page.prev_cursor)
+        assert [p.id for p in page] == ids
+    assert not page.has_prev
+
+
+def query_plans(query, **cursor):
+    """执行一次分页，返回其中每条 SELECT 的 EXPLAIN QUERY PLAN 文本"""
+    statements = []
+
+    def capture(conn, cursor_, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        keyset_paginate(query, PER_PAGE, **cursor)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', capture)
+
+    plans = []
+    with db.engine.connect() as conn:
+        for statement, parameters in statements:
+            rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+            plans.append(' / '.join(row[-1] for row in rows))
+    return plans
+
+
+@pytest.mark.parametrize('status', [None, 'cafe_arrived'])
+@pytest.mark.parametrize('direction', ['after', 'before'])
+def test_deep_page_is_an_index_seek(app, status, direction):
+    query = Package.query
+    if status:
+        query = query.filter_by(status=status)
+    ids = expected_order(query)
+    deep = db.session.get(Package, ids[len(ids) * 3 // 4])  # 有日期的行中靠后的位置
+    undated = db.session.get(Package, ids[-PER_PAGE // 2])  # 日期为空的尾部
+
+    for package in (deep, undated):
+        plans = query_plans(query, **{direction: encode_cursor(package)})
+        assert plans
+        for plan in plans:
+            assert 'cafe_arrival_desc' in plan, plan
+            assert plan.startswith('SEARCH'), plan
+            assert 'TEMP B-TREE' not in plan, plan
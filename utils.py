@@ -1,11 +1,7 @@
 import logging
-from flask import render_template
+from flask import render_template, current_app
 from flask_mail import Message
-from datetime import datetime, timedelta
-import qrcode
-import io
-import base64
-from email_validator import validate_email, EmailNotValidError
+from datetime import datetime
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -13,14 +9,23 @@ logger = logging.getLogger(__name__)
 
 def validate_email_address(email):
     """验证邮箱地址格式"""
+    # email_validator（及其依赖的 dnspython/idna）导入较慢，只在新建包裹时才需要
+    from email_validator import validate_email, EmailNotValidError
     try:
         validate_email(email)
         return True
     except EmailNotValidError:
         return False
 
+def render_email(template_name, package, **context):
+    """渲染邮件模板：优先使用预编译的批量渲染器，否则退回 render_template"""
+    renderer = current_app.extensions.get('email_renderer')
+    if renderer is not None:
+        return renderer.render(template_name, package, **context)
+    return render_template(template_name, package=package, **context)
+
 def send_shenzhen_arrival_email(package, mail):
-    """发送深圳仓库到达通知邮件"""
+    """发送深圳仓库到达通知邮件（mail 可以是 Mail 或 SMTPConnectionPool）"""
     try:
         msg = Message(
             subject=f'您的包裹已到达深圳仓库 - 快递单号: {package.shenzhen_tracking_number}',
@@ -28,25 +33,15 @@ def send_shenzhen_arrival_email(package, mail):
             recipients=[package.customer_email]
         )
         
-        msg.html = render_template(
+        msg.html = render_email(
             'email/shenzhen_arrival.html',
-            package=package
+            package
         )
         
         mail.send(msg)
         
-        # 更新邮件发送状态 - 在应用上下文中执行
-        with mail.app.app_context():
-            from models import db
-            # 重新查询包裹以确保数据是最新的
-            updated_package = db.session.get(package.__class__, package.id)
-            if updated_package:
-                updated_package.shenzhen_email_sent = True
-                updated_package.updated_at = datetime.utcnow()
-                db.session.commit()
-                logger.info(f"深圳到达邮件发送成功并更新状态: {package.customer_email}")
-            else:
-                logger.warning(f"包裹不存在，无法更新状态: {package.id}")
+        # 发送状态（shenzhen_email_sent）由调用方按批次统一更新
+        logger.info(f"深圳到达邮件发送成功: {package.customer_email}")
         
         return True
     except Exception as e:
@@ -54,7 +49,7 @@ def send_shenzhen_arrival_email(package, mail):
         return False
 
 def send_cafe_arrival_email(package, mail):
-    """发送咖啡馆到达通知邮件"""
+    """发送咖啡馆到达通知邮件（mail 可以是 Mail 或 SMTPConnectionPool）"""
     try:
         msg = Message(
             subject=f'您的包裹已到达咖啡馆 - 取件码: {package.pickup_code}，请到咖啡馆取件',
@@ -62,34 +57,27 @@ def send_cafe_arrival_email(package, mail):
             recipients=[package.customer_email]
         )
         
-        msg.html = render_template(
+        msg.html = render_email(
             'email/cafe_arrival.html',
-            package=package,
-            timedelta=timedelta
+            package
         )
         
         mail.send(msg)
         
-        # 更新邮件发送状态 - 在应用上下文中执行
-        with mail.app.app_context():
-            from models import db
-            # 重新查询包裹以确保数据是最新的
-            updated_package = db.session.get(package.__class__, package.id)
-            if updated_package:
-                updated_package.cafe_email_sent = True
-                updated_package.updated_at = datetime.utcnow()
-                db.session.commit()
-                logger.info(f"咖啡馆到达邮件发送成功并更新状态: {package.customer_email}")
-            else:
-                logger.warning(f"包裹不存在，无法更新状态: {package.id}")
+        # 发送状态（cafe_email_sent）由调用方按批次统一更新
+        logger.info(f"咖啡馆到达邮件发送成功: {package.customer_email}")
         
         return True
     except Exception as e:
         logger.error(f"发送咖啡馆到达邮件失败: {e}")
         return False
 
-def generate_pickup_codes_qr(packages):
-    """生成批量二维码，内容为移动端取件码页面网址，便于微信扫码跳转"""
+def generate_pickup_codes_qr(packages, total=None):
+    """生成批量二维码，内容为移动端取件码页面网址，便于微信扫码跳转
+
+    total 为包裹总数（packages 只是当前页时传入）
+    返回 (二维码缓存键, 预览文本)，图片通过 /qr/<key>.png 获取
+    """
     if not packages:
         return None, None
     
@@ -111,29 +99,18 @@ def generate_pickup_codes_qr(packages):
     
     url = f"{base_url}/mobile_pickup"
     
-    # 生成二维码
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(url)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    buf = io.BytesIO()
-    img.save(buf, format='PNG')
-    qr_image = base64.b64encode(buf.getvalue()).decode('utf-8')
+    # 二维码只取决于网址，从缓存中取，缺失时才生成
+    qr_key = current_app.extensions['qr_cache'].ensure(url, box_size=10, error='L', border=4)
     
     # 生成更详细的预览内容
     preview_content = f"""二维码内容预览：
 URL: {url}
 功能: 移动端取件码查看页面
 用途: 扫描后可在手机上查看所有取件码
-包含包裹数量: {len(packages)} 个
+包含包裹数量: {total if total is not None else len(packages)} 个
 生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"""
     
-    return qr_image, preview_content
+    return qr_key, preview_content
 
 def format_datetime(dt, format_str='%Y-%m-%d %H:%M'):
     """格式化日期时间"""
@@ -0,0 +1,34 @@
+"""
+生产环境WSGI入口: gunicorn -c gunicorn.conf.py wsgi:app
+
+gunicorn 以 preload_app 方式在主进程中导入本模块：建表补索引、预编译模板（读写字节码缓存）只做一次，
+fork 出的工作进程直接共享；每个工作进程启动后再由 post_fork 调用 after_fork()。
+"""
+
+import logging
+import os
+from app import create_app, init_database, precompile_templates
+from models import db
+
+logger = logging.getLogger(__name__)
+
+
+def after_fork():
+    """在每个工作进程中调用: 重建数据库连接池、预热连接和缓存、启动发件worker"""
+    with app.app_context():
+        # 主进程的连接不能跨进程共用，只丢弃引用不关闭（关闭会影响其他进程）
+        db.engine.dispose(close=False)
+        app.extensions['change_feed'].after_fork()
+        with db.engine.connect() as conn:
+            conn.execute(db.text('SELECT 1'))
+        app.extensions['active_codes'].load()
+        db.session.remove()
+        app.extensions['mail_queue'].ensure_started()
+    logger.info(f"工作进程已就绪 (pid={os.getpid()})")
+
+
+app = create_app(os.environ.get('FLASK_CONFIG', 'production'))
+init_database(app)
+logger.info(f"已预编译 {precompile_templates(app)} 个模板")
+with app.app_context():
+    db.engine.dispose()  # 主进程不保留连接，工作进程各自建立